@@ -0,0 +1,199 @@
+"""
+Benchmarks for the WikiExtractor pipeline, run on tests/wikiextractor_test_dir/input/test.xml
+scaled up by repeating its pages.
+
+	python tests/benchmark.py scanner [--copies N]
+	python tests/benchmark.py reader [--copies N]
+	python tests/benchmark.py workers [--copies N | --tiny N] [--workers 1 4 16]
+	python tests/benchmark.py templates [--templates N] [--workers 1 4 16]
+	python tests/benchmark.py template_cache [--templates N]
+"""
+import os, sys, argparse, tempfile, pickle, resource, shutil
+import multiprocessing
+from multiprocessing import Pool
+from timeit import default_timer
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(tests_dir))
+from wikiextractor.WikiExtractor import pages_from, pages_from_bytes, page_metadata, pages_from_mapped, articleKeys
+from wikiextractor.WikiExtractor import options, manual_main, manifest_name, share_templates
+from wikiextractor.WikiExtractor import Template, SharedTemplateCache, TemplateCache
+
+dump_file_path = tests_dir + '/wikiextractor_test_dir/input/test.xml'
+
+def make_scaled_dump(copies, directory):
+	"""Write test.xml with its pages repeated :param copies: times, each copy with fresh page ids"""
+	with open(dump_file_path, 'rb') as f:
+		data = f.read()
+	start = data.index(b'<page>')
+	end = data.rindex(b'</mediawiki>')
+	header, pages, footer = data[:start], data[start:end], data[end:]
+	path = os.path.join(directory, 'scaled.xml')
+	with open(path, 'wb') as f:
+		f.write(header)
+		for i in range(copies):
+			f.write(pages.replace(b'<id>', b'<id>%d' % i))
+		f.write(footer)
+	return path
+
+def read_blocks(f):
+	while f.read(1 << 20):
+		yield None
+
+def make_tiny_dump(count, directory):
+	"""Write a dump of :param count: tiny pages, like most Wiktionary entries, with the header of test.xml"""
+	with open(dump_file_path, 'rb') as f:
+		data = f.read()
+	header = data[:data.index(b'<page>')]
+	path = os.path.join(directory, 'tiny.xml')
+	with open(path, 'wb') as f:
+		f.write(header)
+		for i in range(count):
+			f.write(b'<page>\n<title>word%d</title>\n<ns>0</ns>\n<id>%d</id>\n<revision>\n<id>%d</id>\n'
+					b'<text xml:space="preserve">==English==\n\n===Noun===\n\'\'\'word%d\'\'\'\n\n# A word.\n</text>\n'
+					b'</revision>\n</page>\n' % (i, i + 1, i + 1, i))
+		f.write(b'</mediawiki>\n')
+	return path
+
+def bench_scanner(path):
+	size = os.path.getsize(path)
+	runs = [
+		('read', 'rb', read_blocks),
+		('pages_from', 'r', pages_from),
+		('pages_from_bytes', 'rb', pages_from_bytes),
+		('articles only', 'rb', lambda f: pages_from_bytes(f, namespaces=articleKeys)),
+		('page_metadata', 'rb', page_metadata),
+	]
+	results = []
+	for name, mode, scanner in runs:
+		with open(path, mode) as f:
+			start = default_timer()
+			count = sum(1 for _ in scanner(f))
+			results.append((name, count, default_timer() - start))
+	print(f'{size / 2**20:.1f} MB, {results[1][1]} pages')
+	for name, pages, elapsed in results:
+		rate = '' if name == 'read' else f'{pages / elapsed:,.0f} pages/s'
+		print(f'{name:>18}: {elapsed:.2f}s  {rate:>16}  {size / 2**20 / elapsed:,.1f} MB/s')
+	print(f'speedup: {results[1][2] / results[2][2]:.1f}x')
+
+def run_reader(args):
+	"""Reads the dump like the mapper of process_dump, pickling the jobs, in a fresh process"""
+	name, path = args
+	with open(path, 'rb') as f:
+		pages = pages_from_bytes(f, namespaces=articleKeys) if name == 'stream' else pages_from_mapped(path, articleKeys)
+		jobs_size = sum(len(pickle.dumps(page_data)) for page_data in pages)
+	usage = resource.getrusage(resource.RUSAGE_SELF)
+	return usage.ru_utime + usage.ru_stime, usage.ru_maxrss / 1024, jobs_size / 2**20
+
+def bench_reader(path):
+	print(f'{os.path.getsize(path) / 2**20:.1f} MB')
+	for name in ['stream', 'mapped']:
+		with Pool(1, maxtasksperchild=1) as pool:
+			cpu, rss, jobs_size = pool.apply((run_reader), ((name, path),))
+		print(f'{name:>8}: CPU {cpu:.2f}s  peak RSS {rss:.0f} MB  jobs {jobs_size:.1f} MB')
+
+def bench_workers(path, worker_counts):
+	"""Runs the whole extraction, sending pages one by one, in adaptive batches and through shared memory"""
+	output = os.path.join(os.path.dirname(path), 'output')
+	batch_pages = options.batch_pages
+	for workers in worker_counts:
+		for name, pages_per_batch, shared_memory in [('single', 1, 0), ('batched', batch_pages, 0), ('shared', batch_pages, 64)]:
+			options.batch_pages = pages_per_batch
+			options.shared_memory = shared_memory
+			start = default_timer()
+			manual_main(path, output, workers)
+			elapsed = default_timer() - start
+			with open(os.path.join(output, manifest_name)) as f:
+				pages = sum(1 for _ in f)
+			shutil.rmtree(output)
+			print(f'{workers:>3} workers {name:>8}: {elapsed:.2f}s  {pages / elapsed:,.0f} pages/s')
+	options.batch_pages = batch_pages
+	options.shared_memory = 0
+
+def process_memory():
+	"""RSS and proportional set size (PSS, shared pages divided among the processes sharing them) of this process, in MB"""
+	memory = {}
+	with open('/proc/self/smaps_rollup') as f:
+		for line in f:
+			fields = line.split()
+			if len(fields) == 3:
+				memory[fields[0]] = int(fields[1]) / 1024
+	return memory['Rss:'], memory['Pss:']
+
+def template_worker(opts, titles, results):
+	"""Looks up every template, as a long extraction eventually does, and reports its memory"""
+	for title in titles:
+		opts.templates[title]
+	results.put(process_memory())
+
+def bench_templates(count, worker_counts):
+	"""Memory of the extract processes, given the templates as dicts or as a shared TemplateDB"""
+	titles = ['Template:t%d' % i for i in range(count)]
+	body = '{{#if:{{{1|}}}|<span class="%d">{{{1}}}</span>|{{{2|none}}}}}'
+	for method in ['fork', 'spawn']:
+		context = multiprocessing.get_context(method)
+		for name in ['dicts', 'shared']:
+			options.templates = {title: body % i for i, title in enumerate(titles)}
+			options.redirects = {}
+			path = share_templates() if name == 'shared' else None
+			for workers in worker_counts:
+				results = context.Queue()
+				processes = [context.Process(target=template_worker, args=(options, titles, results))
+							 for _ in range(workers)]
+				for process in processes:
+					process.start()
+				memory = [results.get() for _ in processes]
+				for process in processes:
+					process.join()
+				rss = sum(m[0] for m in memory) / workers
+				pss = sum(m[1] for m in memory) / workers
+				print(f'{method:>5} {name:>6} {workers:>3} workers: per worker RSS {rss:.0f} MB  PSS {pss:.0f} MB')
+			if path:
+				options.templates.close()
+				os.remove(path)
+
+def bench_template_cache(count):
+	"""Time to get a parsed template: parsing it, from a Manager dict, from the shared cache, from the process cache"""
+	body = ('<span class="{{{class|{{{cls|x%d}}}}}}" lang="{{{lang|en}}}">{{#if:{{{1|}}}|{{{1}}}|{{{2|{{{alt|none}}}}}}}}</span>'
+			' and {{{3|}}} or {{{4|default {{{5|five}}}}}} ')
+	bodies = {'Template:t%d' % i: body.replace('%d', str(i)) * (1 + i % 8) for i in range(count)}
+	shared = SharedTemplateCache(64 * 2**20)
+	cache = TemplateCache(count, shared)
+	with multiprocessing.Manager() as manager:
+		managed = manager.dict()
+		for title, text in bodies.items():
+			cache[title] = managed[title] = Template.parse(text)
+		runs = [
+			('parse', lambda title: Template.parse(bodies[title])),
+			('Manager dict', managed.get),
+			('shared cache', shared.get),
+			('process cache', cache.get),
+		]
+		for name, get in runs:
+			start = default_timer()
+			for title in bodies:
+				get(title)
+			elapsed = default_timer() - start
+			print(f'{name:>14}: {elapsed / count * 1e6:.1f} us per template')
+	shared.close()
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('benchmark', choices=['scanner', 'reader', 'workers', 'templates', 'template_cache'])
+	parser.add_argument('--copies', type=int, default=500, help='times to repeat the pages of test.xml')
+	parser.add_argument('--tiny', type=int, help='use a dump of TINY tiny pages instead of test.xml')
+	parser.add_argument('--templates', type=int, default=200000, help='number of templates')
+	parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16], help='numbers of extract processes')
+	args = parser.parse_args()
+	with tempfile.TemporaryDirectory() as directory:
+		path = make_tiny_dump(args.tiny, directory) if args.tiny else make_scaled_dump(args.copies, directory)
+		if args.benchmark == 'scanner':
+			bench_scanner(path)
+		elif args.benchmark == 'reader':
+			bench_reader(path)
+		elif args.benchmark == 'workers':
+			bench_workers(path, args.workers)
+		elif args.benchmark == 'templates':
+			bench_templates(args.templates, args.workers)
+		elif args.benchmark == 'template_cache':
+			bench_template_cache(args.templates)
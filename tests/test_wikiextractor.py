@@ -0,0 +1,604 @@
+import os, re, bz2, gzip, json, pickle, random, signal, socket, time, urllib.request
+import pytest
+from multiprocessing import Queue, Process, Value
+from types import SimpleNamespace
+import wikiextractor.WikiExtractor as WikiExtractor
+from wikiextractor.WikiExtractor import pages_from, pages_from_bytes, page_metadata, read_multistream_index, stream_spans, pages_from_multistream, DumpIndex
+from wikiextractor.WikiExtractor import manual_main, open_dump, dump_parts, pages_from_parts, PreviousOutput, pages_from_mapped, decode_page
+from wikiextractor.WikiExtractor import options, Extractor, FlowControl, reduce_process, SharedRing, Template, TemplateDB, use_template_db, share_templates
+from wikiextractor.WikiExtractor import SharedTemplateCache, TemplateCache, JobBatcher, LookAhead, language_parts, run_remote_worker
+from wikiextractor.WikiExtractor import PipelineStats, StatsReporter, WorkerPool, WorkerStatus
+
+tests_dir = os.path.dirname(__file__)
+dump_file_path = tests_dir + '/wikiextractor_test_dir/input/test.xml'
+
+def read_pages(pages):
+	return [(id, revid, title, ns, ''.join(page)) for id, revid, title, ns, catSet, page in pages]
+
+def make_multistream(directory, pages_per_stream=3):
+	"""Repack test.xml as a multistream dump in :param directory:, returns the paths of the dump and of its index"""
+	with open(dump_file_path, 'rb') as f:
+		data = f.read()
+	start = data.index(b'  <page>')
+	pages = re.findall(rb'  <page>.*?</page>\n', data[start:], re.DOTALL)
+	dump_path, index_path = str(directory) + '/test-multistream.xml.bz2', str(directory) + '/test-multistream-index.txt'
+	with open(dump_path, 'wb') as dump, open(index_path, 'wb') as index:
+		dump.write(bz2.compress(data[:start]))
+		for i in range(0, len(pages), pages_per_stream):
+			offset = dump.tell()
+			for page in pages[i:i + pages_per_stream]:
+				id, title = re.search(rb'<id>(\d+)</id>', page).group(1), re.search(rb'<title>(.*?)</title>', page).group(1)
+				index.write(b'%d:%s:%s\n' % (offset, id, title))
+			dump.write(bz2.compress(b''.join(pages[i:i + pages_per_stream])))
+		dump.write(bz2.compress(b'</mediawiki>\n'))
+	return dump_path, index_path
+
+def make_parts(directory, pages_per_part=4):
+	"""Split test.xml into dump parts in :param directory:, each with the header of the dump, returns their paths"""
+	with open(dump_file_path, 'rb') as f:
+		data = f.read()
+	start, end = data.index(b'  <page>'), data.rindex(b'</mediawiki>')
+	pages = re.findall(rb'  <page>.*?</page>\n', data[start:end], re.DOTALL)
+	paths = []
+	for i in range(0, len(pages), pages_per_part):
+		paths.append(str(directory) + '/test-pages%d.xml.bz2' % (len(paths) + 1))
+		with open(paths[-1], 'wb') as f:
+			f.write(bz2.compress(data[:start] + b''.join(pages[i:i + pages_per_part]) + data[end:]))
+	return paths
+
+def test_pages_from_bytes():
+	with open(dump_file_path, 'r') as f:
+		expected = read_pages(pages_from(f))
+	for block_size in [None, 64, 4096]: # small blocks split tags and pages across reads
+		with open(dump_file_path, 'rb') as f:
+			pages = read_pages(pages_from_bytes(f, block_size))
+		assert len(pages) == len(expected)
+		# The last 'loach' page in test.xml is missing its </page>, so pages_from glues the
+		# text of the duplicate that follows onto it, while pages_from_bytes keeps only its own text
+		assert pages[:-1] == expected[:-1], f'Mismatch with block_size={block_size}'
+		assert pages[-1][:4] == expected[-1][:4]
+		assert expected[-1][4].startswith(pages[-1][4])
+	assert [p[2] for p in pages][4:6] == ['dictionary', 'free']
+
+def test_pages_from_mapped():
+	with open(dump_file_path, 'rb') as f:
+		expected = read_pages(pages_from_bytes(f, namespaces={'0'}))
+	pages = list(pages_from_mapped(dump_file_path, {'0'}))
+	# the text crosses to the extract processes as offsets into the file
+	pages = [page_data[:5] + (decode_page(pickle.loads(pickle.dumps(page_data[5]))),) for page_data in pages]
+	assert read_pages(pages) == expected
+
+def test_pipelined_decompression(tmp_path):
+	with open(dump_file_path, 'rb') as f:
+		data = f.read()
+	with open(dump_file_path, 'rb') as f:
+		expected = read_pages(pages_from_bytes(f))
+	for ext, compress in [('.bz2', bz2.compress), ('.gz', gzip.compress)]:
+		path = str(tmp_path) + '/test.xml' + ext
+		with open(path, 'wb') as f:
+			f.write(compress(data))
+		with open_dump(path, pipelined=True) as f:
+			assert f.readline() == data[:data.index(b'\n') + 1]
+			assert read_pages(pages_from_bytes(f, 4096)) == expected
+		with open_dump(path, pipelined=True) as f: # closing before the end stops the thread
+			f.read(10)
+
+def test_pages_from_bytes_namespaces():
+	with open(dump_file_path, 'rb') as f:
+		expected = read_pages(pages_from_bytes(f))
+	with open(dump_file_path, 'rb') as f:
+		pages = read_pages(pages_from_bytes(f, 64, namespaces={'0'}))
+	assert [p[:4] for p in pages] == [p[:4] for p in expected]
+	assert [p[4] for p in pages if p[3] == '0'] == [p[4] for p in expected if p[3] == '0']
+	assert all(p[4] == '' for p in pages if p[3] != '0')
+
+def test_page_metadata():
+	with open(dump_file_path, 'rb') as f:
+		expected = read_pages(pages_from_bytes(f))
+	for block_size in [None, 64]:
+		with open(dump_file_path, 'rb') as f:
+			metadata = list(page_metadata(f, block_size))
+		assert [m[:4] for m in metadata] == [p[:4] for p in expected]
+	# the size is taken from <text bytes="...">
+	assert metadata[4][2] == 'dictionary' and metadata[4][4] == 17381
+
+def test_pages_from_multistream(tmp_path):
+	dump_path, index_path = make_multistream(tmp_path)
+	offsets, selected = read_multistream_index(index_path, {'free', 'cat'})
+	assert len(offsets) == 5 and len(selected) == 2
+	with open(dump_file_path, 'rb') as f:
+		expected = read_pages(pages_from_bytes(f))
+	spans = stream_spans(dump_path, offsets)
+	assert read_pages(pages_from_multistream(dump_path, spans, 2)) == expected
+	# only the streams holding the selected titles are read
+	pages = read_pages(pages_from_multistream(dump_path, [span for span in spans if span[0] in selected], 2))
+	assert 'free' in [p[2] for p in pages] and 'cat' in [p[2] for p in pages] and len(pages) == 5
+	unselected = []
+	read_multistream_index(index_path, {'free', 'cat'}, unselected.append)
+	assert sorted(unselected + [p[0] for p in pages]) == sorted(p[0] for p in expected)
+
+def test_dump_index(tmp_path):
+	with open(dump_file_path, 'rb') as f:
+		data = f.read()
+	dump_index = DumpIndex.build(dump_file_path, str(tmp_path) + '/test.xml.index')
+	page = dump_index.read_page('dictionary')
+	assert page.startswith(b'  <page>\n    <title>dictionary</title>') and page.endswith(b'</page>\n')
+	assert page in data
+	assert dump_index.read_page(id=16) == page
+	assert dump_index.read_page('missing') is None
+	assert dump_index.is_current()
+
+	dump_path, index_path = make_multistream(tmp_path)
+	multistream_index = DumpIndex.build(dump_path, dump_path + '.index', multistream_index=index_path, process_count=2)
+	for title in ['dictionary', 'cat', 'loach', 'Wiktionary:Welcome, newcomers']:
+		assert multistream_index.read_page(title) == dump_index.read_page(title)
+
+def test_template_db(tmp_path):
+	templates = {'Template:L': '{{{3|{{{2}}}}}}', 'Template:Also': "''See also:'' {{{1}}}"}
+	redirects = {'Template:Link': 'Template:L'}
+	path = str(tmp_path) + '/templates.db'
+	TemplateDB.write(path, templates, redirects)
+	db = pickle.loads(pickle.dumps(TemplateDB(path))) # worker processes map the file again
+	assert len(db) == 3
+	assert 'Template:L' in db and 'Template:Link' not in db and 'Template:X' not in db
+	assert db['Template:Also'] == templates['Template:Also']
+	assert db.redirects.get('Template:Link') == 'Template:L' and db.redirects.get('Template:L') is None
+	assert str(db.template('Template:L')) == str(Template.parse(templates['Template:L']))
+
+	saved = options.templates, options.redirects, options.templateCache, options.templatePrefix
+	try:
+		text = '{{l|en|word}} {{link|en|other}} {{also|this}}'
+		options.templatePrefix = 'Template:'
+		options.templates, options.redirects, options.templateCache = dict(templates), dict(redirects), {}
+		expected = Extractor(1, 1, 'test', [text]).expand(text)
+		assert expected == "word other ''See also:'' this"
+		use_template_db(path)
+		assert Extractor(1, 1, 'test', [text]).expand(text) == expected
+	finally:
+		options.templates, options.redirects, options.templateCache, options.templatePrefix = saved
+
+def put_template(cache, title, body):
+	cache.put(title, Template.parse(body))
+
+def test_template_cache():
+	body = "{{{1|{{{lang|en}}}}}} ''{{{2}}}''"
+	assert str(Template.from_compact(Template.parse(body).compact())) == str(Template.parse(body))
+	shared = SharedTemplateCache(64 * 1024)
+	try:
+		process = Process(target=put_template, args=(shared, 'Template:Q', body))
+		process.start()
+		process.join()
+		assert str(shared.get('Template:Q')) == str(Template.parse(body))
+		assert shared.get('Template:R') is None
+		for i in range(60): # fills the table, then clears it
+			shared.put('Template:%d' % i, Template.parse(body))
+		assert shared.clears.value == 1 and shared.get('Template:Q') is None and shared.get('Template:59')
+
+		cache = TemplateCache(2, shared)
+		cache['Template:A'] = Template.parse(body)
+		cache['Template:B'] = Template.parse(body)
+		assert cache.get('Template:A') is not None
+		cache['Template:C'] = Template.parse(body) # evicts B, the least recently used
+		assert list(cache.templates) == ['Template:A', 'Template:C']
+		assert cache.get('Template:B') is not None # from the shared cache
+		assert cache.get('Template:D') is None
+		cache.flush_stats()
+		assert list(cache.stats) == [1, 1, 3, 2] # hits, shared hits, parsed, evicted
+	finally:
+		shared.close()
+
+def test_templates_not_collected(tmp_path, monkeypatch, caplog):
+	manual_main(dump_file_path, str(tmp_path) + '/expected')
+	monkeypatch.setattr(options, 'expand_templates', True)
+	monkeypatch.setattr(options, 'spool_dir', str(tmp_path))
+	caplog.set_level('INFO')
+	# without --templates or --template_db, a mapped dump is not scanned for templates
+	WikiExtractor.process_dump(dump_file_path, False, str(tmp_path) + '/output', 1024**2, False, 1)
+	assert 'Collecting template definitions' not in caplog.text
+	assert not [name for name in os.listdir(str(tmp_path)) if name.endswith('.tpldb')]
+
+def test_shared_templates_removed(tmp_path, monkeypatch):
+	manual_main(dump_file_path, str(tmp_path) + '/expected')
+	monkeypatch.setattr(options, 'expand_templates', True)
+	monkeypatch.setattr(options, 'spool_dir', str(tmp_path))
+	def failing_cache(size):
+		raise MemoryError()
+	monkeypatch.setattr(WikiExtractor, 'SharedTemplateCache', failing_cache)
+	monkeypatch.setattr(options, 'templates', {'Template:L': '{{{1}}}'})
+	monkeypatch.setattr(options, 'redirects', {})
+	monkeypatch.setattr(options, 'templateCache', {})
+	try:
+		WikiExtractor.process_dump(dump_file_path, False, str(tmp_path) + '/output', 1024**2, False, 1)
+		assert False, 'extracted without a template cache'
+	except MemoryError:
+		pass
+	# the temporary database goes with a failed extraction too
+	assert not [name for name in os.listdir(str(tmp_path)) if name.endswith('.tpldb')]
+
+def test_share_templates(tmp_path, monkeypatch):
+	saved = options.templates, options.redirects, options.templateCache
+	try:
+		monkeypatch.setattr(options, 'templatePrefix', 'Template:')
+		monkeypatch.setattr(options, 'spool_dir', str(tmp_path))
+		options.templates, options.redirects, options.templateCache = {'Template:L': '{{{3|{{{2}}}}}}'}, {'Template:Link': 'Template:L'}, {}
+		text = '{{l|en|word}} {{link|en|other}}'
+		path = share_templates()
+		assert os.path.dirname(path) == str(tmp_path) and isinstance(options.templates, TemplateDB)
+		assert os.path.getsize(path) < 200 # bodies only, parsed on lookup
+		assert Extractor(1, 1, 'test', [text]).expand(text) == 'word other'
+		assert isinstance(options.templateCache['Template:L'], Template)
+		options.templates.close()
+	finally:
+		options.templates, options.redirects, options.templateCache = saved
+
+def test_pages_from_parts(tmp_path):
+	paths = make_parts(tmp_path, 2)
+	assert len(paths) > 4 and dump_parts([str(tmp_path) + '/test-pages*.xml.bz2']) == paths # pages10 after pages2
+	expected = []
+	for path in paths:
+		with bz2.open(path) as f:
+			expected += read_pages(pages_from_bytes(f))
+	for process_count in [1, 3]:
+		assert read_pages(pages_from_parts(paths, process_count)) == expected
+	with pytest.raises(ValueError):
+		dump_parts([paths[0], str(tmp_path) + '/missing.xml.bz2'])
+	# a part that cannot be read fails the scan, rather than leave it waiting
+	with open(paths[1], 'wb') as f:
+		f.write(b'BZh91AY&SY corrupt')
+	with pytest.raises(RuntimeError, match='test-pages2'):
+		read_pages(pages_from_parts(paths, 2))
+	with pytest.raises(RuntimeError, match='missing'):
+		read_pages(pages_from_parts([paths[0], str(tmp_path) + '/missing.xml'], 2))
+
+def test_previous_output(tmp_path):
+	os.makedirs(str(tmp_path) + '/AA')
+	with bz2.open(str(tmp_path) + '/AA/wiki_00.bz2', 'wb') as f:
+		f.write('{"id": "1"}\n{"id": "2", "title": "é"}\n'.encode('utf-8'))
+	with open(str(tmp_path) + '/manifest.tsv', 'w') as f:
+		f.write('1\t10\tAA/wiki_00.bz2\t0\t12\n2\t20\tAA/wiki_00.bz2\t12\t28\n3\t30\tAA/wiki_00.bz2\t40\t0\n')
+	previous = PreviousOutput(str(tmp_path) + '/manifest.tsv')
+	assert previous.text('2', '20') == '{"id": "2", "title": "é"}\n'
+	assert previous.text('1', '11') is None # changed
+	assert previous.text('4', '40') is None # new
+	assert (previous.reused, previous.changed, previous.new, previous.deleted) == (1, 1, 1, 1)
+	previous.skip('3') # filtered out, but still in the dump
+	previous.skip('3')
+	previous.skip('5')
+	assert previous.deleted == 0
+
+def test_reduce_process_reorders(tmp_path):
+	pages = [(i, str(i), str(i + 100), 'page %d\n' % i, None) for i in range(50)]
+	random.Random(1).shuffle(pages)
+	flow = FlowControl(len(pages), 1024)
+	output_queue = Queue()
+	for i in range(0, len(pages), 7): # batches, as sent by the extract processes
+		flow.acquire(len(pages[i:i + 7]))
+		output_queue.put(pages[i:i + 7])
+	output_queue.put(None)
+	opts = SimpleNamespace(**vars(options))
+	opts.quiet, opts.debug, opts.log_file = True, False, None
+	try:
+		reduce_process(opts, output_queue, flow, str(tmp_path), 1024**2, False)
+	finally:
+		WikiExtractor.options = options # reduce_process sets the global options
+	with open(str(tmp_path) + '/AA/wiki_00') as f:
+		assert f.read() == ''.join('page %d\n' % i for i in range(50))
+	assert flow.pending.value == 0 and flow.buffered.value == 0
+	with open(str(tmp_path) + '/manifest.tsv') as f:
+		assert f.readline() == '0\t100\tAA/wiki_00\t0\t7\n'
+
+def test_lookahead(monkeypatch):
+	monkeypatch.setattr(options, 'lookahead_min_cost', 1000)
+	monkeypatch.setattr(options, 'lookahead_factor', 3)
+	batches = []
+	flow = FlowControl(10, 1 << 20)
+	batcher = JobBatcher(SimpleNamespace(put=batches.append), None, flow, SimpleNamespace(value=0.0))
+	batcher.batch_pages = 2
+	lookahead = LookAhead(batcher, 3)
+	for page_num in range(8):
+		if page_num == 7:
+			flow.pending.value = flow.max_pages # no room
+		text = 'x' * (5000 if page_num in (4, 7) else 10)
+		lookahead.add((str(page_num), None, 'page', [text], page_num, None), len(text))
+	flow.pending.value = 0
+	lookahead.flush()
+	# page 4 goes ahead of pages 1, 2 and 3, page 7 finds no room for it in the flow control
+	assert [[job[4] for job in batch] for batch in batches] == [[4], [0, 1], [2, 3], [5, 6], [7]]
+	assert (lookahead.early, lookahead.declined) == (1, 1)
+
+def test_shared_ring():
+	ring = SharedRing(100)
+	try:
+		first, second = ring.write(b'a' * 40), ring.write(b'b' * 40)
+		assert (first.start, second.start) == (0, 40)
+		assert ring.write(b'c' * 40) is None # records do not wrap around the end
+		ring.release(first.end)
+		third = ring.write(b'c' * 40)
+		assert third.start == 100 and third.end - ring.tail.value == 100
+		third = pickle.loads(pickle.dumps(third))
+		with ring.view(third) as view:
+			assert bytes(view) == b'c' * 40
+		with ring.view(second) as view:
+			assert bytes(view) == b'b' * 40
+	finally:
+		ring.close()
+
+def test_language_parts():
+	text = '{{also|Tea}}\n==English==\n# tea\n==French==\n{{quote|\n==Latin==\n}}\n==Latin==\n# thea\n'
+	assert language_parts(text) == ['{{also|Tea}}\n==English==\n# tea\n', '==French==\n{{quote|\n==Latin==\n}}\n', '==Latin==\n# thea\n']
+	assert language_parts('==English==\n&lt;ref&gt;\n==French==\n&lt;/ref&gt;\n') == ['==English==\n&lt;ref&gt;\n==French==\n&lt;/ref&gt;\n']
+
+def test_language_parts_unclosed(monkeypatch):
+	# a construct left open early on a large page is not scanned again at every header
+	text = '==English==\n{{unclosed\n' + ''.join('==L%d==\n%s\n' % (i, 'word ' * 200) for i in range(2000))
+	scanned = []
+	count_opened = WikiExtractor.count_opened
+	monkeypatch.setattr(WikiExtractor, 'count_opened', lambda text, opened: scanned.append(len(text)) or count_opened(text, opened))
+	assert language_parts(text) == [text]
+	assert sum(scanned) <= len(text)
+
+def test_split_languages(tmp_path, monkeypatch):
+	manual_main(dump_file_path, str(tmp_path) + '/expected', 2)
+	monkeypatch.setattr(options, 'split_languages', 0.001) # every page
+	manual_main(dump_file_path, str(tmp_path) + '/output', 2)
+	with open(str(tmp_path) + '/expected/AA/wiki_00', 'rb') as f:
+		expected = f.read()
+	with open(str(tmp_path) + '/output/AA/wiki_00', 'rb') as f:
+		assert f.read() == expected
+
+def test_quarantine_split_page(tmp_path, monkeypatch):
+	extract_data = Extractor.extract_data
+	def hanging_extract_data(self):
+		if self.title == 'free' and self.text.startswith('==Galician=='):
+			time.sleep(60)		# the second part hangs, after the first is done
+		return extract_data(self)
+	monkeypatch.setattr(Extractor, 'extract_data', hanging_extract_data)
+	monkeypatch.setattr(options, 'split_languages', 0.001)
+	monkeypatch.setattr(options, 'page_timeout', 1)
+	monkeypatch.setattr(options, 'page_retries', 1)
+	manual_main(dump_file_path, str(tmp_path) + '/output', 2)
+	with open(str(tmp_path) + '/output/quarantine.tsv') as f:
+		quarantined = [line.split('\t') for line in f]
+	assert [(fields[2], fields[4].strip()) for fields in quarantined] == [('free', 'timeout')]
+
+def test_worker_pool_recovers(tmp_path, monkeypatch):
+	extract = Extractor.extract
+	def failing_extract(self, out):
+		if self.title == 'free':
+			time.sleep(60)		# hangs
+		elif self.title == 'encyclopaedia':
+			os._exit(1)			# crashes
+		extract(self, out)
+	manual_main(dump_file_path, str(tmp_path) + '/expected', 2)
+	monkeypatch.setattr(Extractor, 'extract', failing_extract) # inherited by the forked extract processes
+	monkeypatch.setattr(options, 'page_timeout', 1)
+	monkeypatch.setattr(options, 'batch_pages', 3)
+	manual_main(dump_file_path, str(tmp_path) + '/output', 2)
+	with open(str(tmp_path) + '/expected/AA/wiki_00') as f:
+		expected = [json.loads(line) for line in f]
+	with open(str(tmp_path) + '/output/AA/wiki_00') as f:
+		output = [json.loads(line) for line in f]
+	assert [page for page in expected if page['title'] not in ('free', 'encyclopaedia')] == output
+	with open(str(tmp_path) + '/output/quarantine.tsv') as f:
+		quarantined = [line.split('\t') for line in f]
+	assert sorted((fields[2], fields[4].strip()) for fields in quarantined) == [('encyclopaedia', 'exit code 1'), ('free', 'timeout')]
+
+def test_worker_pool_results_outlive_process(tmp_path, monkeypatch):
+	manual_main(dump_file_path, str(tmp_path) + '/expected', 2)
+	end_batch = WorkerStatus.end_batch
+	crashed = str(tmp_path) + '/crashed'
+	def crashing_end_batch(self, i):
+		end_batch(self, i)
+		if not os.path.exists(crashed):
+			open(crashed, 'w').close()
+			os._exit(1)			# right after putting the results of a batch, and counting it done
+	monkeypatch.setattr(WorkerStatus, 'end_batch', crashing_end_batch)
+	monkeypatch.setattr(options, 'batch_pages', 3)
+	manual_main(dump_file_path, str(tmp_path) + '/output', 2)
+	assert os.path.exists(crashed)
+	with open(str(tmp_path) + '/expected/AA/wiki_00') as f, open(str(tmp_path) + '/output/AA/wiki_00') as g:
+		assert f.read() == g.read()
+
+def test_unordered_output(tmp_path, monkeypatch):
+	manual_main(dump_file_path, str(tmp_path) + '/expected', 2)
+	monkeypatch.setattr(options, 'unordered', True)
+	monkeypatch.setattr(options, 'batch_pages', 3)
+	manual_main(dump_file_path, str(tmp_path) + '/output', 2)
+	assert not os.path.exists(str(tmp_path) + '/output/AA')
+	# the manifest lists the pages in dump order
+	with open(str(tmp_path) + '/output/manifest.tsv') as f:
+		pages = [line.split('\t')[:2] for line in f]
+	previous = PreviousOutput(str(tmp_path) + '/output/manifest.tsv')
+	with open(str(tmp_path) + '/expected/AA/wiki_00') as f:
+		assert ''.join(previous.text(id, revid) for id, revid in pages) == f.read()
+
+def test_remote_workers(tmp_path, monkeypatch):
+	manual_main(dump_file_path, str(tmp_path) + '/expected', 2)
+	with socket.socket() as s:
+		s.bind(('localhost', 0))
+		address = s.getsockname()
+	monkeypatch.setattr(options, 'coordinator', address)
+	coordinator = Process(target=manual_main, args=(dump_file_path, str(tmp_path) + '/output'))
+	coordinator.start()
+	extract_data = Extractor.extract_data
+	def failing_worker():
+		pages = []
+		def failing_extract_data(self):
+			options.batch_bytes = 1		# returns its pages one by one
+			pages.append(self.title)
+			if len(pages) == 3:
+				os._exit(1)				# disconnects in the middle of its first batch
+			return extract_data(self)
+		Extractor.extract_data = failing_extract_data
+		run_remote_worker(address, options.authkey)
+	worker = Process(target=failing_worker)
+	worker.start()
+	worker.join()
+	assert worker.exitcode == 1
+	worker = Process(target=run_remote_worker, args=(address, options.authkey))
+	worker.start()
+	worker.join()
+	coordinator.join()
+	with open(str(tmp_path) + '/expected/AA/wiki_00', 'rb') as f:
+		expected = f.read()
+	with open(str(tmp_path) + '/output/AA/wiki_00', 'rb') as f:
+		assert f.read() == expected
+	# the public default key is only good within this machine
+	try:
+		run_remote_worker(('192.0.2.1', address[1]), options.authkey)
+		assert False, 'connected with the default key'
+	except ValueError:
+		pass
+
+def test_remote_worker_timeout(tmp_path, monkeypatch):
+	manual_main(dump_file_path, str(tmp_path) + '/expected', 2)
+	with socket.socket() as s:
+		s.bind(('localhost', 0))
+		address = s.getsockname()
+	monkeypatch.setattr(options, 'coordinator', address)
+	monkeypatch.setattr(options, 'page_timeout', 1)
+	coordinator = Process(target=manual_main, args=(dump_file_path, str(tmp_path) + '/output'))
+	coordinator.start()
+	hanging = str(tmp_path) + '/hanging'
+	extract_data = Extractor.extract_data
+	def hanging_worker():
+		def hanging_extract_data(self):
+			if self.title == 'free':
+				open(hanging, 'w').close()
+				time.sleep(60)
+			return extract_data(self)
+		Extractor.extract_data = hanging_extract_data
+		run_remote_worker(address, options.authkey)
+	worker = Process(target=hanging_worker)
+	worker.start()
+	for _ in range(300):
+		if os.path.exists(hanging):
+			break
+		time.sleep(0.1)
+	healthy = Process(target=run_remote_worker, args=(address, options.authkey))
+	healthy.start()
+	coordinator.join(60)
+	worker.kill()
+	healthy.join()
+	assert coordinator.exitcode == 0
+	with open(str(tmp_path) + '/expected/AA/wiki_00', 'rb') as f:
+		expected = f.read()
+	with open(str(tmp_path) + '/output/AA/wiki_00', 'rb') as f:
+		assert f.read() == expected
+
+def test_pipeline_stats(tmp_path, monkeypatch):
+	monkeypatch.setattr(options, 'stats_file', str(tmp_path) + '/stats.json')
+	manual_main(dump_file_path, str(tmp_path) + '/output', 2)
+	with open(str(tmp_path) + '/output/AA/wiki_00') as f:
+		pages = len(f.readlines())
+	with open(str(tmp_path) + '/stats.json') as f:
+		stats = json.load(f)
+	assert stats['read_pages'] - stats['filtered_pages'] == stats['queued_pages'] == pages
+	assert stats['extracted_pages'] == stats['written_pages'] == pages
+	assert len(stats['workers']) == 2 and sum(worker['extracted_pages'] for worker in stats['workers']) == pages
+	stats = PipelineStats(1)
+	stats.workers[0].add('extracted_pages', 3)
+	with socket.socket() as s:
+		s.bind(('localhost', 0))
+		port = s.getsockname()[1]
+	reporter = StatsReporter(stats, port=port)
+	with urllib.request.urlopen('http://localhost:%d/metrics' % port) as response:
+		metrics = response.read().decode('utf-8')
+	reporter.close()
+	assert 'wikiextractor_extracted_pages_total 3.0\n' in metrics
+	assert 'wikiextractor_worker_extracted_pages_total{worker="0"} 3.0\n' in metrics
+
+def test_resume(tmp_path, monkeypatch):
+	manual_main(dump_file_path, str(tmp_path) + '/expected', 2)
+	monkeypatch.setattr(options, 'checkpoint_period', 1e-6)	# after every page written
+	monkeypatch.setattr(options, 'batch_pages', 1)
+	monkeypatch.setattr(JobBatcher, 'initial_pages', 1)
+	extract = Extractor.extract
+	def interrupted_run():
+		os.setpgrp()
+		def hanging_extract(self, out):
+			if self.title == 'encyclopaedia':
+				time.sleep(60)
+			extract(self, out)
+		Extractor.extract = hanging_extract
+		manual_main(dump_file_path, str(tmp_path) + '/output', 2)
+	run = Process(target=interrupted_run)
+	run.start()
+	checkpoint = str(tmp_path) + '/output/checkpoint.json'
+	for _ in range(300):
+		if os.path.exists(checkpoint):
+			with open(checkpoint) as f:
+				if json.load(f)['last_id'] == '29':	# the page before the hanging one
+					break
+		time.sleep(0.1)
+	else:
+		assert False, 'no checkpoint'
+	os.killpg(run.pid, signal.SIGKILL)
+	run.join()
+	monkeypatch.setattr(options, 'resume', True)
+	manual_main(dump_file_path, str(tmp_path) + '/output', 2)
+	assert not os.path.exists(checkpoint)
+	for name in ('AA/wiki_00', 'manifest.tsv'):
+		with open(str(tmp_path) + '/expected/' + name, 'rb') as f:
+			expected = f.read()
+		with open(str(tmp_path) + '/output/' + name, 'rb') as f:
+			assert f.read() == expected
+
+def test_autoscale(tmp_path, monkeypatch, caplog):
+	manual_main(dump_file_path, str(tmp_path) + '/expected', 1)
+	extract = Extractor.extract
+	def slow_extract(self, out):
+		time.sleep(0.1)
+		extract(self, out)
+	monkeypatch.setattr(Extractor, 'extract', slow_extract)
+	monkeypatch.setattr(WikiExtractor.CpuUsage, 'busy', lambda self: 0.5)
+	monkeypatch.setattr(options, 'autoscale', (1, 3))
+	monkeypatch.setattr(options, 'autoscale_period', 0)
+	monkeypatch.setattr(options, 'batch_pages', 1)
+	monkeypatch.setattr(JobBatcher, 'initial_pages', 1)
+	caplog.set_level('INFO')
+	manual_main(dump_file_path, str(tmp_path) + '/output', 1)
+	assert 'Scaling from 1 to 2 extract processes' in caplog.text
+	with open(str(tmp_path) + '/expected/AA/wiki_00') as f, open(str(tmp_path) + '/output/AA/wiki_00') as g:
+		assert f.read() == g.read()
+	# idle processes are retired
+	monkeypatch.setattr(options, 'autoscale_period', 60)
+	pool = WorkerPool(2, Queue(), Value('d', 0.0, lock=False), scale=(1, 2))
+	with pool.lock:
+		pool.idle = pool.samples = 2
+		pool.autoscale()
+	assert pool.count == 1
+	pool.close()
+	assert pool.processes[1] is None
+
+def test_executors(tmp_path, monkeypatch):
+	monkeypatch.setattr(options, 'executor', 'processes')
+	monkeypatch.setattr(options, 'split_languages', 1)
+	for executor in ('processes', 'threads', 'inline'):
+		manual_main(dump_file_path, str(tmp_path) + '/' + executor, 2, executor)
+	for name in ('AA/wiki_00', 'manifest.tsv'):
+		with open(str(tmp_path) + '/processes/' + name) as f:
+			expected = f.read()
+		for executor in ('threads', 'inline'):
+			with open(str(tmp_path) + '/' + executor + '/' + name) as f:
+				assert f.read() == expected
+
+def test_lookahead_small_reorder_memory(tmp_path, monkeypatch):
+	# early pages fill the reorder buffer ahead of pages still in the look-ahead window
+	manual_main(dump_file_path, str(tmp_path) + '/expected', 2)
+	monkeypatch.setattr(options, 'reorder_memory', 1e-6)
+	monkeypatch.setattr(options, 'lookahead_min_cost', 1)
+	monkeypatch.setattr(options, 'lookahead_factor', 1)
+	monkeypatch.setattr(options, 'batch_pages', 1)
+	monkeypatch.setattr(JobBatcher, 'initial_pages', 1)
+	def run_in_group():
+		os.setpgrp()
+		manual_main(dump_file_path, str(tmp_path) + '/output', 2)
+	run = Process(target=run_in_group)
+	run.start()
+	run.join(60)
+	if run.exitcode is None:
+		os.killpg(run.pid, signal.SIGKILL)		# deadlocked
+	assert run.exitcode == 0
+	with open(str(tmp_path) + '/expected/AA/wiki_00') as f, open(str(tmp_path) + '/output/AA/wiki_00') as g:
+		assert f.read() == g.read()
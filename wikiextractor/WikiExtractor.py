@@ -52,6 +52,29 @@ the following structure
 Template expansion requires preprocesssng first the whole dump and
 collecting template definitions.
 
+The output directory also gets a manifest.tsv, listing the id, revid,
+file, offset and length of the output of each page, which allows
+--incremental extraction of a later dump.
+
+With --unordered, each extract process writes its pages as they are done
+to a shard_NN directory of its own, with a manifest of their page numbers,
+and the manifest of the output directory lists them in dump order.
+
+With --coordinator, the extract processes run on other machines, where they
+are started with --worker, and connect over TCP.
+
+The output is made durable every --checkpoint seconds, recording in
+checkpoint.json where to --resume it after an interrupted run.
+
+With --autoscale, the number of extract processes follows the load: one is
+started when the reader waits for them, and one is retired when they wait for
+the reader or the writer, or the CPUs are saturated.
+
+With --executor threads, the extract processes and the reduce process are
+threads of the main process instead, and with --executor inline the main
+process extracts and writes each batch of pages itself, which is simpler to
+profile and faster for small dumps. The output is the same.
+
 """
 
 from __future__ import unicode_literals, division
@@ -61,14 +84,35 @@ import argparse
 import bz2
 import codecs
 import cgi
-import fileinput
+import glob
+import gzip
+import hashlib
+import heapq
+import io
+import ipaddress
 import logging
 import os.path
 import re  # TODO use regex when it will be standard
+import socket
+import sqlite3
+import marshal
+import mmap
+import pickle
+import struct
+import tempfile
+import threading
 import time
 import json
 from io import StringIO
-from multiprocessing import Queue, Process, Value, cpu_count
+from multiprocessing import Queue, Process, Value, Array, Lock, Pool, Condition, cpu_count, shared_memory
+from multiprocessing import SimpleQueue, Semaphore
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+from queue import Queue as ThreadQueue
+from collections import deque, OrderedDict
+from functools import partial
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from array import array
 from timeit import default_timer
 from urllib.parse import quote
 from html.entities import name2codepoint
@@ -84,6 +128,9 @@ version = '2.75'
 
 ## PARAMS ####################################################################
 
+# Public, so only good for connections within this machine, see check_authkey()
+default_authkey = b'wikiextractor'
+
 options = SimpleNamespace(
 
 	##
@@ -160,10 +207,17 @@ options = SimpleNamespace(
 	# Shared objects holding templates, redirects and cache
 	templates = {},
 	redirects = {},
-	# cache of parser templates
-	# FIXME: sharing this with a Manager slows down.
+	# cache of parser templates, a TemplateCache when expanding templates
 	templateCache = {},
 
+	##
+	# Number of parsed templates kept by each extract process
+	template_cache_size = 10000,
+
+	##
+	# Megabytes of shared memory for the parsed templates shared by the extract processes
+	template_cache = 64,
+
 	# Elements to ignore/discard
 
 	ignored_tag_patterns = [],
@@ -172,6 +226,109 @@ options = SimpleNamespace(
 
 	log_file = None,
 
+	##
+	# Number of processes decompressing a multistream dump, 0 for a quarter of --processes
+	decompress_processes = 0,
+
+	##
+	# Directory for the articles spooled while collecting templates, None for the system default
+	spool_dir = None,
+
+	##
+	# Pre-parsed template database (see TemplateDB), used instead of templates and redirects when it exists
+	template_db = None,
+
+	##
+	# Maximum number of pages dispatched and not yet written
+	reorder_pages = 10000,
+
+	##
+	# Maximum size in MB of the extracted pages waiting in the reorder buffer for an earlier page
+	reorder_memory = 512,
+
+	##
+	# Maximum number of pages and bytes of text in a message to or from the extract processes
+	batch_pages = 100,
+	batch_bytes = 1 << 20,
+
+	##
+	# Seconds of extraction a batch is sized for, after the recent time per page
+	batch_time = 0.05,
+
+	##
+	# Pages of at least this many kilobytes are split at their language sections,
+	# which the extract processes extract in parallel, 0 for no split
+	split_languages = 0,
+
+	##
+	# Pages the mapper looks ahead for expensive pages to dispatch early, 0 for none
+	lookahead = 1000,
+
+	##
+	# A page is expensive when its estimated cost is this many times the average,
+	# and at least lookahead_min_cost, where the cost is the size of the text plus
+	# template_cost for each template call
+	lookahead_factor = 20,
+	lookahead_min_cost = 100000,
+	template_cost = 200,
+
+	##
+	# Size in MB of the shared memory rings carrying page text to and from the extract
+	# processes, 0 to send it through the queues
+	shared_memory = 0,
+
+	##
+	# Seconds an extract process may spend on a page before it is restarted, 0 for no limit
+	page_timeout = 300,
+
+	##
+	# Failures after which a page is quarantined rather than dispatched again
+	page_retries = 2,
+
+	##
+	# File listing the quarantined pages, None for quarantine.tsv in the output directory
+	quarantine_file = None,
+
+	##
+	# Whether each extract process writes its output to its own shard, in no particular order
+	unordered = False,
+
+	##
+	# (host, port) where to listen for the extract processes of other machines, started
+	# with --worker, instead of running extract processes here; None to run them here
+	coordinator = None,
+
+	##
+	# Key authenticating the coordinator and its workers to each other, which unpickle
+	# what they receive
+	authkey = default_authkey,
+
+	##
+	# File where to write the statistics of the stages of the extraction as JSON, every
+	# stats_period seconds, and port of localhost where to serve them to Prometheus
+	stats_file = None,
+	stats_port = 0,
+	stats_period = 10,
+
+	##
+	# Seconds between the checkpoints of the output, 0 for none
+	checkpoint_period = 300,
+
+	##
+	# Whether to resume the output from its last checkpoint
+	resume = False,
+
+	##
+	# (min, max) number of extract processes to scale between after the load, every
+	# autoscale_period seconds; None for a fixed number
+	autoscale = None,
+	autoscale_period = 5,
+
+	##
+	# How the pages are extracted and written: 'processes' in extract processes and a
+	# reduce process, 'threads' in threads of this process, 'inline' by the mapper itself
+	executor = 'processes',
+
 	discardElements = [
 		'gallery', 'timeline', 'noinclude', 'pre',
 		'table', 'tr', 'td', 'th', 'caption', 'div',
@@ -187,8 +344,12 @@ options = SimpleNamespace(
 templateKeys = set(['10', '828'])
 
 ##
-# Regex for identifying disambig pages
-filter_disambig_page_pattern = re.compile(r"{{disambig(uation)?(\|[^}]*)?}}|__DISAMBIG__")
+# Keys for the namespaces of the pages that are extracted: Article and Reconstruction
+articleKeys = set(['0', '118'])
+
+##
+# Regex for identifying disambig pages, at the start of any line of the page
+filter_disambig_page_pattern = re.compile(r"^(?:{{disambig(uation)?(\|[^}]*)?}}|__DISAMBIG__)", re.MULTILINE)
 
 ##
 g_page_total = 0
@@ -198,14 +359,13 @@ g_page_articl_used_total=0
 def keepPage(ns, catSet, page):
 	global g_page_articl_total,g_page_total,g_page_articl_used_total
 	g_page_total += 1
-	if ns not in  ['0', '118']:				  # Article or Reconstruction
+	if ns not in articleKeys:				  # Article or Reconstruction
 		return False
 	# remove disambig pages if desired
 	g_page_articl_total += 1
 	if options.filter_disambig_pages:
-		for line in page:
-			if filter_disambig_page_pattern.match(line):
-				return False
+		if filter_disambig_page_pattern.search(''.join(page)):
+			return False
 	if len(options.filter_category_include) > 0 and len(options.filter_category_include & catSet)==0:
 		logging.debug("***No include  " + str(catSet))
 		return False
@@ -395,6 +555,32 @@ class Template(list):
 		tpl.append(TemplateText(body[start:]))	# leftover
 		return tpl
 
+	def compact(self):
+		"""
+		:return: the template as nested lists, for marshal: a TemplateText
+			becomes a str, a TemplateArg a pair of its compact name and default.
+		"""
+		return [text_type(x) if isinstance(x, TemplateText) else
+				(x.name.compact(), x.default.compact() if x.default is not None else None)
+				for x in self]
+
+	@classmethod
+	def from_compact(cls, items):
+		"""
+		:return: the Template of :param items:, from compact(), which is
+			several times faster than parsing it again.
+		"""
+		tpl = Template()
+		for x in items:
+			if isinstance(x, text_type):
+				tpl.append(TemplateText(x))
+			else:
+				arg = TemplateArg.__new__(TemplateArg)
+				arg.name = cls.from_compact(x[0])
+				arg.default = cls.from_compact(x[1]) if x[1] is not None else None
+				tpl.append(arg)
+		return tpl
+
 
 	def subst(self, params, extractor, depth=0):
 		# We perform parameter substitutions recursively.
@@ -580,6 +766,12 @@ class Extractor(object):
 		"""
 		:param out: a memory file.
 		"""
+		self.write_output(out, self.extract_data())
+
+	def extract_data(self):
+		"""
+		:return: the data of the page, by language.
+		"""
 		# But I want the other info
 		# logging.info('%s\t%s', self.id, self.title)
 
@@ -637,8 +829,6 @@ class Extractor(object):
 		# if sum(len(line) for line in text) < options.min_text_length:
 		#	return
 
-		self.write_output(out, data)
-
 		errs = (self.template_title_errs,
 				self.recursion_exceeded_1_errs,
 				self.recursion_exceeded_2_errs,
@@ -646,6 +836,7 @@ class Extractor(object):
 		if any(errs):
 			logging.warn("Template errors in article '%s' (%s): title(%d) recursion(%d, %d, %d)",
 						 self.title, self.id, *errs)
+		return data
 
 
 	def transform(self, wikitext):
@@ -1027,14 +1218,17 @@ class Extractor(object):
 			title = redirected
 
 		# get the template
-		if title in options.templateCache:
-			template = options.templateCache[title]
-		elif title in options.templates:
-			template = Template.parse(options.templates[title])
+		template = options.templateCache.get(title)
+		if template is None:
+			if isinstance(options.templates, TemplateDB):
+				template = options.templates.template(title)	# pre-parsed, unless shared
+			elif title in options.templates:
+				template = Template.parse(options.templates[title])
+				del options.templates[title]
 			# add it to cache
-			options.templateCache[title] = template
-			del options.templates[title]
-		else:
+			if template is not None:
+				options.templateCache[title] = template
+		if template is None:
 			# The page being included could not be identified
 			logging.debug('%*s<EXPAND %s %s', self.frame.depth, '', title, '')
 			return ''
@@ -2017,6 +2211,333 @@ def define_template(title, page):
 		options.templates[title] = text
 
 
+class TemplateDB(object):
+	"""
+	Read-only database of template definitions, memory-mapped from a file
+	written by TemplateDB.write().
+	It replaces both options.templates and options.redirects: each entry
+	holds the redirect of a title, its cleaned template body and the body
+	already parsed into a Template, decoded only when the title is looked up.
+	Worker processes map the same file and so share its pages.
+
+	File layout, integers in native byte order:
+		magic, count, table offset
+		entries: key length (I), key, value length (I), pickled (redirect, body, template),
+			where template may be None, to be parsed from body on lookup
+		table: offsets (Q) of the entries, sorted by key
+	"""
+
+	magic = b'WXTPLDB1'
+
+	def __init__(self, path):
+		self.path = path
+		self.open()
+
+	def open(self):
+		with open(self.path, 'rb') as f:
+			self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		if self.mm[:8] != self.magic:
+			raise ValueError("not a template database: %s" % self.path)
+		self.count, table_offset = struct.unpack_from('QQ', self.mm, 8)
+		self.table = memoryview(self.mm)[table_offset:table_offset + 8 * self.count].cast('Q')
+		self.redirects = TemplateDBRedirects(self)
+
+	def __getstate__(self):
+		# processes map the file again rather than copy it
+		return self.path
+
+	def __setstate__(self, path):
+		self.path = path
+		self.open()
+
+	@classmethod
+	def is_template_db(cls, path):
+		with open(path, 'rb') as f:
+			return f.read(len(cls.magic)) == cls.magic
+
+	@classmethod
+	def write(cls, path, templates, redirects, parsed=True):
+		"""
+		Write the database of :param templates: and :param redirects:, the
+		dicts filled by define_template().
+		:param parsed: whether to store the parsed templates, which takes
+			several times the size of their bodies.
+		"""
+		entries = {}
+		for title, body in templates.items():
+			entries[title] = (redirects.get(title), body, Template.parse(body) if parsed else None)
+		for title, target in redirects.items():
+			if title not in entries:
+				entries[title] = (target, None, None)
+		keys = sorted((title.encode('utf-8'), title) for title in entries)
+		table = array('Q')
+		with open(path, 'wb') as f:
+			f.write(cls.magic + struct.pack('QQ', len(keys), 0))
+			for key, title in keys:
+				value = pickle.dumps(entries[title], pickle.HIGHEST_PROTOCOL)
+				table.append(f.tell())
+				f.write(struct.pack('I', len(key)) + key + struct.pack('I', len(value)) + value)
+			table_offset = f.tell()
+			table.tofile(f)
+			f.seek(len(cls.magic))
+			f.write(struct.pack('QQ', len(keys), table_offset))
+		logging.info("Saved %d templates and %d redirects to '%s'", len(templates), len(redirects), path)
+
+	def entry(self, title):
+		"""
+		:return: the (redirect, body, template) for :param title:, or None.
+		"""
+		key = title.encode('utf-8')
+		mm = self.mm
+		lo, hi = 0, self.count
+		while lo < hi:			# binary search of key in table
+			mid = (lo + hi) // 2
+			offset = self.table[mid]
+			size, = struct.unpack_from('I', mm, offset)
+			if mm[offset + 4:offset + 4 + size] < key:
+				lo = mid + 1
+			else:
+				hi = mid
+		if lo == self.count:
+			return None
+		offset = self.table[lo]
+		size, = struct.unpack_from('I', mm, offset)
+		if mm[offset + 4:offset + 4 + size] != key:
+			return None
+		offset += 4 + size
+		size, = struct.unpack_from('I', mm, offset)
+		return pickle.loads(mm[offset + 4:offset + 4 + size])
+
+	def template(self, title):
+		"""
+		:return: the parsed Template for :param title:, or None.
+		"""
+		entry = self.entry(title)
+		if not entry:
+			return None
+		return entry[2] if entry[2] is not None or entry[1] is None else Template.parse(entry[1])
+
+	def __contains__(self, title):
+		entry = self.entry(title)
+		return bool(entry and entry[1] is not None)
+
+	def __getitem__(self, title):
+		entry = self.entry(title)
+		if not entry or entry[1] is None:
+			raise KeyError(title)
+		return entry[1]
+
+	def __len__(self):
+		return self.count
+
+	def close(self):
+		self.table.release()
+		self.mm.close()
+
+
+class TemplateDBRedirects(object):
+	"""
+	The redirects of a TemplateDB, standing for options.redirects.
+	"""
+
+	def __init__(self, db):
+		self.db = db
+
+	def get(self, title, default=None):
+		entry = self.db.entry(title)
+		return entry[0] if entry and entry[0] else default
+
+
+def share_templates():
+	"""
+	Replace options.templates and options.redirects with a temporary
+	TemplateDB, shared by the extract processes.
+	:return: the path of the database, to be removed at the end.
+	"""
+	fd, path = tempfile.mkstemp(suffix='.tpldb', dir=options.spool_dir)
+	os.close(fd)
+	# each process parses the templates it uses, and keeps them in options.templateCache
+	TemplateDB.write(path, options.templates, options.redirects, parsed=False)
+	use_template_db(path)
+	return path
+
+
+def use_template_db(path):
+	"""
+	Use the template database at :param path: for template expansion.
+	"""
+	db = TemplateDB(path)
+	options.templates = db
+	options.redirects = db.redirects
+	options.templateCache = {}
+	return db
+
+
+class SharedTemplateCache(object):
+	"""
+	Parsed templates shared by the extract processes, so that a template
+	parsed by one of them is loaded by the others, in its compact form.
+	A hash table in shared memory indexes entries appended to an arena.
+	When either fills up, the cache is cleared, to be filled again by the
+	templates still in use.
+	Writers hold the lock. Readers do not: they check that the generation,
+	odd while the cache is being cleared, did not change while reading.
+
+	Layout, integers in native byte order:
+		generation, arena end, entries (Q)
+		table: slots of (hash, offset) (QQ), hash 0 for a free slot
+		arena: key length (I), key, value length (I), marshalled value
+	"""
+
+	header_size = 24
+
+	def __init__(self, size):
+		self.slots = max(size // 1024, 16)
+		self.arena = self.header_size + 16 * self.slots
+		self.shm = shared_memory.SharedMemory(create=True, size=max(size, 2 * self.arena))
+		self.size = self.shm.size
+		self.lock = Lock()
+		self.clears = Value('q', 0, lock=False)
+		self.clear()
+
+	@staticmethod
+	def hash(key):
+		return struct.unpack('Q', hashlib.blake2b(key, digest_size=8).digest())[0] | 1
+
+	def find(self, key, h):
+		"""
+		:return: the slot of :param key:, with hash :param h:, or the free
+			slot where it would go, and the offset of its entry or 0.
+		"""
+		buf = self.shm.buf
+		slot = h % self.slots
+		while True:
+			position = self.header_size + 16 * slot
+			slot_hash, offset = struct.unpack_from('QQ', buf, position)
+			if slot_hash == 0:
+				return position, 0
+			if slot_hash == h:
+				size, = struct.unpack_from('I', buf, offset)
+				if buf[offset + 4:offset + 4 + size] == key:
+					return position, offset
+			slot = (slot + 1) % self.slots
+
+	def get(self, title):
+		"""
+		:return: the Template for :param title:, or None.
+		"""
+		key = title.encode('utf-8')
+		buf = self.shm.buf
+		generation, = struct.unpack_from('Q', buf, 0)
+		if generation % 2:
+			return None
+		try:
+			_, offset = self.find(key, self.hash(key))
+			if not offset:
+				return None
+			offset += 4 + len(key)
+			size, = struct.unpack_from('I', buf, offset)
+			items = marshal.loads(buf[offset + 4:offset + 4 + size])
+		except (ValueError, EOFError, TypeError, struct.error):
+			return None			# cleared while reading
+		if struct.unpack_from('Q', buf, 0)[0] != generation:
+			return None
+		return Template.from_compact(items)
+
+	def put(self, title, template):
+		"""
+		Share :param template: as :param title:.
+		"""
+		key = title.encode('utf-8')
+		value = marshal.dumps(template.compact())
+		length = 8 + len(key) + len(value)
+		if self.arena + length > self.size:
+			return
+		h = self.hash(key)
+		buf = self.shm.buf
+		with self.lock:
+			generation, end, entries = struct.unpack_from('QQQ', buf, 0)
+			if end + length > self.size or 4 * (entries + 1) > 3 * self.slots:
+				self.clear()
+				generation, end, entries = struct.unpack_from('QQQ', buf, 0)
+			position, offset = self.find(key, h)
+			if offset:
+				return			# shared meanwhile by another process
+			struct.pack_into('I', buf, end, len(key))
+			buf[end + 4:end + 4 + len(key)] = key
+			struct.pack_into('I', buf, end + 4 + len(key), len(value))
+			buf[end + 8 + len(key):end + length] = value
+			# the hash last, once the entry is complete
+			struct.pack_into('Q', buf, position + 8, end)
+			struct.pack_into('Q', buf, position, h)
+			struct.pack_into('QQ', buf, 8, end + length, entries + 1)
+
+	def clear(self):
+		"""Empties the cache, holding the lock or before it is shared."""
+		buf = self.shm.buf
+		generation, = struct.unpack_from('Q', buf, 0)
+		if generation:
+			self.clears.value += 1
+		struct.pack_into('Q', buf, 0, generation + 1)		# odd: clearing
+		buf[self.header_size:self.arena] = bytes(self.arena - self.header_size)
+		struct.pack_into('QQQ', buf, 0, generation + 2, self.arena, 0)
+
+	def close(self):
+		self.shm.close()
+		self.shm.unlink()
+
+
+class TemplateCache(object):
+	"""
+	The parsed templates used by a process, up to :param size:, evicting the
+	least recently used, in front of an optional SharedTemplateCache.
+	Counts in shared stats the templates found, found in the shared cache,
+	added after parsing them, and evicted.
+	"""
+
+	def __init__(self, size, shared=None):
+		self.size = size
+		self.shared = shared
+		self.templates = OrderedDict()
+		self.lock = threading.Lock()	# between extract threads
+		self.stats = Array('q', 4)
+		self.counts = [0] * 4		# not yet added to stats
+
+	def get(self, title):
+		with self.lock:
+			template = self.templates.get(title)
+			if template is not None:
+				self.templates.move_to_end(title)
+				self.counts[0] += 1
+				return template
+		template = self.shared.get(title) if self.shared else None
+		if template is None:
+			return None
+		self.counts[1] += 1
+		self.add(title, template)
+		return template
+
+	def __setitem__(self, title, template):
+		self.counts[2] += 1
+		self.add(title, template)
+		if self.shared and template is not None:
+			self.shared.put(title, template)
+
+	def add(self, title, template):
+		with self.lock:
+			self.templates[title] = template
+			if len(self.templates) > self.size:
+				self.templates.popitem(last=False)
+				self.counts[3] += 1
+
+	def flush_stats(self):
+		"""Adds the counts of this process to the shared stats."""
+		with self.stats.get_lock():
+			for i, count in enumerate(self.counts):
+				self.stats[i] += count
+		self.counts = [0] * 4
+
+
 # ----------------------------------------------------------------------
 
 def dropNested(text, openDelim, closeDelim):
@@ -2831,6 +3352,80 @@ def compact(text, page_title, reconstructed_language):
 
 	return data
 
+# A level 2 header, ==Language==, in the raw text of a page
+languageHeader = re.compile(r'^==[^=<>{}\[\]&|]+==[ \t]*$', re.MULTILINE)
+
+# Constructs that may span lines, as (open, close) in the raw text of a page
+spanningOpenClose = [('{{', '}}'), ('[[', ']]'), ('&lt;!--', '--&gt;'), ('<!--', '-->')]
+tableOpen = re.compile(r'^[ \t]*\{\|', re.MULTILINE)
+tableClose = re.compile(r'^[ \t]*\|\}', re.MULTILINE)
+tagOpen = re.compile(r'(?:<|&lt;)([a-zA-Z]+)\b(?:(?!&gt;)[^>])*?(?<!/)(?:>|&gt;)')
+tagClose = re.compile(r'(?:<|&lt;)/([a-zA-Z]+)\s*(?:>|&gt;)')
+voidTags = set(['br', 'hr', 'wbr', 'img'])
+
+def count_opened(text, opened):
+	"""
+	Adds to :param opened: the number of each construct that :param text:
+	opens but does not close, keyed by its opening, so that the text closes
+	every construct it opens when all the counts are 0, and extracts the
+	same alone as followed by more text.
+	Counts over consecutive texts add up, as long as they are not cut within
+	a construct, as before the header lines of language_parts().
+	"""
+	for o, c in spanningOpenClose:
+		opened[o] = opened.get(o, 0) + text.count(o) - text.count(c)
+	opened['{|'] = opened.get('{|', 0) + len(tableOpen.findall(text)) - len(tableClose.findall(text))
+	for tag in tagOpen.findall(text):
+		tag = '<' + tag.lower()
+		if tag[1:] not in voidTags:
+			opened[tag] = opened.get(tag, 0) + 1
+	for tag in tagClose.findall(text):
+		tag = '<' + tag.lower()
+		opened[tag] = opened.get(tag, 0) - 1
+	return opened
+
+def language_parts(text):
+	"""
+	Splits :param text: of a page before its ==Language== headers, where the
+	text before closes all its constructs. compact() starts afresh at such
+	a header, so that the data of each part, merged in order, is the data of
+	the whole page.
+	:return: the list of the parts.
+	"""
+	parts = []
+	start = end = 0
+	opened = {}		# in text[start:end], each header adding only the text since the previous one
+	headers = languageHeader.finditer(text)
+	next(headers, None)		# what comes before the first language goes with it
+	for m in headers:
+		count_opened(text[end:m.start()], opened)
+		end = m.start()
+		if not any(opened.values()):
+			parts.append(text[start:end])
+			start = end
+	parts.append(text[start:])
+	return parts
+
+def merge_language_parts(id, revid, title, parts):
+	"""
+	:param parts: the data of the parts of a page from language_parts(),
+		None for a part that failed.
+	:return: the output of the page.
+	"""
+	if any(data is None for data in parts):
+		return ''			# as when the whole page fails
+	data = {}
+	for part in parts:
+		data.update(part)	# a language repeated keeps its first place and last data, as in compact()
+	out = StringIO()
+	try:
+		Extractor(id, revid, title, []).write_output(out, data)
+	except:
+		logging.exception('Processing page: %s %s', id, title)
+		return ''
+	return out.getvalue()
+
+
 def handle_unicode(entity):
 	numeric_code = int(entity[2:-1])
 	if numeric_code >= 0x10000: return ''
@@ -2878,35 +3473,171 @@ class OutputSplitter(object):
 	File-like object, that splits output to multiple files of a given max size.
 	"""
 
-	def __init__(self, nextFile, max_file_size=0, compress=True):
+	def __init__(self, nextFile, max_file_size=0, compress=True, resume=None):
 		"""
 		:param nextFile: a NextFile object from which to obtain filenames
 			to use.
 		:param max_file_size: the maximum size of each file.
 		:param compress: whether to write data with bzip compression.
+		:param resume: (size, offset) returned by checkpoint(), to append to
+			the current file of :param nextFile: cut back to size.
 		"""
 		self.nextFile = nextFile
 		self.compress = compress
 		self.max_file_size = max_file_size
-		self.file = self.open(next(self.nextFile))
+		if resume:
+			size, self.offset = resume
+			self.file = self.open(nextFile._filepath(), size)
+		else:
+			self.file = self.open(next(self.nextFile))
 
 	def reserve(self, size):
-		if self.file.tell() + size > self.max_file_size:
+		if self.offset + size > self.max_file_size:
 			self.close()
 			self.file = self.open(next(self.nextFile))
 
 	def write(self, data):
+		"""
+		:return: the offset of :param data: within the current file, named
+			by self.filename.
+		"""
 		self.reserve(len(data))
+		offset = self.offset
 		self.file.write(data)
+		self.offset += len(data)
+		return offset
+
+	def checkpoint(self):
+		"""
+		Make the output written so far durable.
+		:return: (size, offset), the size of the current file, and the
+			offset of the next write within it, for :param resume:.
+		"""
+		if self.compress:
+			# ends its bz2 stream, the next one is appended
+			self.file.close()
+			self.file = bz2.BZ2File(self.filename, 'a')
+		else:
+			self.file.flush()
+		fsync_file(self.filename)
+		return os.path.getsize(self.filename), self.offset
 
 	def close(self):
 		self.file.close()
 
-	def open(self, filename):
+	def open(self, filename, size=None):
+		"""
+		:param size: size to cut the file back to, to append to it rather
+			than create it.
+		"""
+		self.filename = filename + '.bz2' if self.compress else filename
+		mode = 'w'
+		if size is None:
+			self.offset = 0
+		else:
+			with open(self.filename, 'r+b') as f:
+				f.truncate(size)
+			mode = 'a'
 		if self.compress:
-			return bz2.BZ2File(filename + '.bz2', 'w')
+			return bz2.BZ2File(self.filename, mode)
 		else:
-			return open(filename, 'wb')
+			return open(self.filename, mode + 'b')
+
+
+def fsync_file(path):
+	"""Flush the file at :param path: to disk."""
+	fd = os.open(path, os.O_RDONLY)
+	try:
+		os.fsync(fd)
+	finally:
+		os.close(fd)
+
+
+class ShardWriter(object):
+	"""
+	Output of one process in --unordered mode: files named by a NextFile in
+	the shard directory of the process, and a manifest of the pages written
+	there, with lines page_num<TAB>id<TAB>revid<TAB>file<TAB>offset<TAB>length.
+	Each put() reaches the disk before returning, compressed as a bz2 stream
+	of its own, so that the output of a process survives its crash.
+	"""
+
+	def __init__(self, out_file, shard, max_file_size=0, compress=True):
+		"""
+		:param out_file: the output directory.
+		:param shard: name of the shard.
+		"""
+		self.out_file = out_file
+		self.directory = os.path.join(out_file, 'shard_%s' % shard)
+		self.max_file_size = max_file_size
+		self.compress = compress
+		self.nextFile = NextFile(self.directory)
+		self.file = None
+		self.filename = None
+		self.size = 0			# uncompressed size of the current file
+		self.manifest = None	# opened with the first page
+		self.lock = threading.Lock()
+
+	def put(self, results):
+		"""
+		Write :param results:, a list of (page_num, id, revid, text, input_end).
+		"""
+		with self.lock:
+			if self.manifest is None:
+				os.makedirs(self.directory, exist_ok=True)
+				self.manifest = open(os.path.join(self.directory, manifest_name), 'a', encoding='utf-8')
+			chunk = []
+			lines = []
+			for page_num, id, revid, text, input_end in results:
+				data = text.encode('utf-8')
+				if self.file is None or (self.size and self.size + len(data) > self.max_file_size):
+					self.write(chunk)
+					chunk = []
+					if self.file:
+						self.file.close()
+					self.filename = next(self.nextFile) + ('.bz2' if self.compress else '')
+					self.file = open(self.filename, 'wb')
+					self.size = 0
+				lines.append('%d\t%s\t%s\t%s\t%d\t%d\n' % (page_num, id, revid,
+															 os.path.relpath(self.filename, self.out_file),
+															 self.size, len(data)))
+				chunk.append(data)
+				self.size += len(data)
+			self.write(chunk)
+			self.manifest.write(''.join(lines))
+			self.manifest.flush()
+
+	def write(self, chunk):
+		if chunk:
+			data = b''.join(chunk)
+			self.file.write(bz2.compress(data) if self.compress else data)
+			self.file.flush()
+
+	def close(self):
+		if self.file:
+			self.file.close()
+		if self.manifest:
+			self.manifest.close()
+
+
+def merge_shard_manifests(out_file):
+	"""
+	Writes the manifest of :param out_file: in page order, from the manifests
+	of its shards, so that the output of --unordered mode can be read in the
+	order of the dump.
+	:return: the number of pages.
+	"""
+	pages = {}
+	for shard_manifest in sorted(glob.glob(os.path.join(out_file, 'shard_*', manifest_name))):
+		with open(shard_manifest, encoding='utf-8') as f:
+			for line in f:
+				page_num, entry = line.split('\t', 1)
+				# a page may have been written again, by a restarted process
+				pages.setdefault(int(page_num), entry)
+	with open(os.path.join(out_file, manifest_name), 'w', encoding='utf-8') as f:
+		for page_num in sorted(pages):
+			f.write(pages[page_num])
+	return len(pages)
 
 
 # ----------------------------------------------------------------------
@@ -2915,6 +3646,8 @@ class OutputSplitter(object):
 tagRE = re.compile(r'(.*?)<(/?\w+)[^>]*?>(?:([^<]*)(<.*?>)?)?')
 #					 1	   2			   3	  4
 keyRE = re.compile(r'key="(\d*)"')
+# bytes attribute of <text>, the size of the page text
+textBytesRE = re.compile(rb'\bbytes="(\d+)"')
 catRE = re.compile(r'\[\[Category:([^\|]+).*\]\].*')  # capture the category name [[Category:Category name|Sortkey]]"
 
 def load_templates(file, output_file=None):
@@ -2922,12 +3655,25 @@ def load_templates(file, output_file=None):
 	Load templates from :param file:.
 	:param output_file: file where to save templates and modules.
 	"""
+	pages = pages_from_bytes(file) if isinstance(file, io.BufferedIOBase) else pages_from(file)
+	for _ in collect_templates(pages, output_file):
+		pass
+
+
+def collect_templates(pages, output_file=None):
+	"""
+	Define the templates and modules found among :param pages:, the tuples
+	yielded by pages_from().
+	:param output_file: file where to save templates and modules.
+	:return: yields back every page, so that articles can be processed in
+	the same pass.
+	"""
 	options.templatePrefix = options.templateNamespace + ':'
 	options.modulePrefix = options.moduleNamespace + ':'
 
 	if output_file:
 		output = codecs.open(output_file, 'wb', 'utf-8')
-	for page_count, page_data in enumerate(pages_from(file)):
+	for page_count, page_data in enumerate(pages):
 		id, revid, title, ns, catSet, page = page_data
 		if not output_file and (not options.templateNamespace or
 								not options.moduleNamespace):  # do not know it yet
@@ -2957,6 +3703,7 @@ def load_templates(file, output_file=None):
 				output.write('</page>\n')
 		if page_count and page_count % 100000 == 0:
 			logging.info("Preprocessed %d pages", page_count)
+		yield page_data
 	if output_file:
 		output.close()
 		logging.info("Saved %d templates to '%s'", len(options.templates), output_file)
@@ -3034,252 +3781,2766 @@ def pages_from(input):
 			page = []
 
 
-def process_dump(input_file, template_file, out_file, file_size, file_compress,
-				 process_count):
+# Size of the blocks read by pages_from_bytes()
+scan_block_size = 1 << 20
+
+
+def open_dump(input_file, pipelined=False):
 	"""
-	:param input_file: name of the wikipedia dump file; '-' to read from stdin
-	:param template_file: optional file with template definitions.
-	:param out_file: directory where to store extracted data, or '-' for stdout
-	:param file_size: max size of each extracted file, or None for no max (one file)
-	:param file_compress: whether to compress files with bzip.
-	:param process_count: number of extraction processes to spawn.
+	Open :param input_file: as a binary stream, decompressing .bz2 and .gz
+	files on the fly like fileinput.hook_compressed does.
+	'-' stands for stdin.
+	:param pipelined: whether to decompress in a separate thread, see
+		DecompressionPipe.
 	"""
-
 	if input_file == '-':
-		input = sys.stdin
+		return sys.stdin.buffer
+	ext = os.path.splitext(input_file)[1]
+	if ext == '.bz2':
+		input = bz2.BZ2File(input_file, 'rb')
+	elif ext == '.gz':
+		input = gzip.GzipFile(input_file, 'rb')
 	else:
-		input = fileinput.FileInput(input_file, openhook=fileinput.hook_compressed)
+		return open(input_file, 'rb')
+	if pipelined:
+		return io.BufferedReader(DecompressionPipe(input), scan_block_size)
+	return input
 
-	# collect siteinfo
-	for line in input:
-		# When an input file is .bz2 or .gz, line can be a bytes even in Python 3.
-		if not isinstance(line, text_type): line = line.decode('utf-8')
-		m = tagRE.search(line)
-		if not m:
-			continue
-		tag = m.group(2)
-		if tag == 'base':
-			# discover urlbase from the xml dump file
-			# /mediawiki/siteinfo/base
-			base = m.group(3)
-			options.urlbase = base[:base.rfind("/")]
-		elif tag == 'namespace':
-			mk = keyRE.search(line)
-			if mk:
-				nsid = ''.join(mk.groups())
+
+class DecompressionPipe(io.RawIOBase):
+	"""
+	Raw stream over a decompressed :param input:, which a thread reads ahead
+	into a bounded buffer of blocks while the caller scans the previous ones.
+	bz2 and zlib release the GIL while decompressing, so the two stages
+	overlap and the stream runs at the pace of the slower one.
+	"""
+
+	def __init__(self, input, buffer_blocks=8, block_size=None):
+		"""
+		:param input: decompressing binary stream.
+		:param buffer_blocks: number of blocks decompressed ahead.
+		:param block_size: size of the blocks, default scan_block_size.
+		"""
+		super().__init__()
+		self.input = input
+		self.block_size = block_size or scan_block_size
+		self.blocks = ThreadQueue(maxsize=buffer_blocks)
+		self.block = memoryview(b'')
+		self.eof = False
+		self.stopped = False
+		# seconds spent decompressing, blocked on a full buffer, and
+		# waiting for a block to scan
+		self.decompress_time = self.full_time = self.empty_time = 0.0
+		self.size = 0
+		self.thread = threading.Thread(target=self.decompress, daemon=True)
+		self.thread.start()
+
+	def decompress(self):
+		try:
+			while not self.stopped:
+				start = default_timer()
+				block = self.input.read(self.block_size)
+				put_start = default_timer()
+				self.decompress_time += put_start - start
+				self.blocks.put(block)
+				self.full_time += default_timer() - put_start
+				if not block:
+					break
+		except Exception as e:
+			self.blocks.put(e)
+
+	def readable(self):
+		return True
+
+	def readinto(self, b):
+		if not self.block:
+			if self.eof:
+				return 0
+			start = default_timer()
+			block = self.blocks.get()
+			self.empty_time += default_timer() - start
+			if isinstance(block, Exception):
+				raise block
+			if not block:
+				self.eof = True
+				return 0
+			self.block = memoryview(block)
+		n = min(len(b), len(self.block))
+		b[:n] = self.block[:n]
+		self.block = self.block[n:]
+		self.size += n
+		return n
+
+	def close(self):
+		if not self.closed:
+			self.stopped = True
+			while self.thread.is_alive():	# unblock the thread
+				while not self.blocks.empty():
+					self.blocks.get()
+				self.thread.join(0.1)
+			self.input.close()
+		super().close()
+
+	def log_timing(self, name, level=logging.INFO):
+		logging.log(level, "Decompressed %.1f MB of %s in %.1fs, blocked %.1fs by the scanner; "
+					"scanning waited %.1fs for decompression",
+					self.size / 1024**2, name, self.decompress_time, self.full_time, self.empty_time)
+
+
+def page_fields(buf, start, end, namespaces=None):
+	"""
+	Locate the fields of the page held in :param buf:[:param start: : :param end:].
+	Only title, namespace and ids are decoded; the text is returned as offsets.
+	:param namespaces: set of namespace keys of the pages whose text end is
+		located, which means scanning all of the text; None for every page.
+	:return: (id, revid, title, ns, redirect, text_start, text_end), where the
+	text offsets are None for a self closing <text/>, and text_end is None
+	for pages outside :param namespaces:.
+	"""
+	s = buf.find(b'<title>', start, end)
+	title = buf[s + 7:buf.find(b'</title>', s, end)].decode('utf-8') if s >= 0 else None
+	s = buf.find(b'<ns>', start, end)
+	ns = buf[s + 4:buf.find(b'</ns>', s, end)].decode('utf-8') if s >= 0 else '0'
+	# the first <id> is the page's, the second the revision's
+	id = revid = None
+	s = buf.find(b'<id>', start, end)
+	if s >= 0:
+		e = buf.find(b'</id>', s, end)
+		id = buf[s + 4:e].decode('utf-8')
+		s = buf.find(b'<id>', e, end)
+		if s >= 0:
+			revid = buf[s + 4:buf.find(b'</id>', s, end)].decode('utf-8')
+	text_start = text_end = None
+	header_end = end
+	s = buf.find(b'<text', start, end)
+	if s >= 0:
+		header_end = s
+		gt = buf.find(b'>', s, end)
+		if buf[gt - 1:gt] != b'/':	# not self closing
+			text_start = gt + 1
+			if namespaces is None or ns in namespaces:
+				text_end = buf.find(b'</text>', text_start, end)
+	redirect = buf.find(b'<redirect', start, header_end) >= 0
+	return id, revid, title, ns, redirect, text_start, text_end
+
+
+def scan_pages(input, block_size=None, start=0):
+	"""
+	Locates the pages in the binary stream :param input:, reading it in large
+	blocks and finding page boundaries with byte searches.
+	:return: (buf, start, end, base) for each page, where buf[start:end] spans
+	from <page> to </page> and base is the position of buf in the stream.
+	buf also holds the line where the page starts and the byte after </page>.
+	An mmap is searched in place, as a single buffer, from :param start:.
+	"""
+	if isinstance(input, mmap.mmap):
+		pos = start
+		while True:
+			start = input.find(b'<page>', pos)
+			end = input.find(b'</page>', start) if start >= 0 else -1
+			if end < 0:
+				return
+			pos = end + 7
+			yield input, start, end, 0
+	block_size = block_size or scan_block_size
+	buf = b''
+	base = 0
+	pos = 0			# where to look for the next <page>
+	eof = False
+	while True:
+		start = buf.find(b'<page>', pos)
+		end = buf.find(b'</page>', start) if start >= 0 else -1
+		if (end < 0 or end + 7 == len(buf)) and not eof:
+			block = input.read(block_size)
+			if block:
+				# keep the incomplete page, or a possibly split '<page>' tag,
+				# from the start of its line
+				keep = max(pos, buf.rfind(b'\n', 0, start if start >= 0 else len(buf)) + 1)
+				buf = buf[keep:] + block
+				base += keep
+				pos = 0
 			else:
-				nsid = ''
-			options.knownNamespaces[m.group(3)] = nsid
-			if re.search('key="10"', line):
-				options.templateNamespace = m.group(3)
-				options.templatePrefix = options.templateNamespace + ':'
-			elif re.search('key="828"', line):
-				options.moduleNamespace = m.group(3)
-				options.modulePrefix = options.moduleNamespace + ':'
-		elif tag == '/siteinfo':
+				eof = True
+			continue
+		if end < 0:
 			break
+		pos = end + 7
+		yield buf, start, end, base
 
-	if options.expand_templates:
-		# preprocess
-		template_load_start = default_timer()
-		if template_file:
-			if os.path.exists(template_file):
-				logging.info("Loading template definitions from: %s", template_file)
-				# can't use with here:
-				file = fileinput.FileInput(template_file,
-										   openhook=fileinput.hook_compressed)
-				load_templates(file)
-				file.close()
+
+def pages_from_bytes(input, block_size=None, namespaces=None):
+	"""
+	Scans the binary stream :param input: extracting pages.
+	Works on large blocks, decoding only the fields that are needed.
+	:param namespaces: set of the namespace keys whose text is wanted: the
+		pages of other namespaces are yielded with an empty page, their
+		text is neither searched nor decoded.
+	:return: (id, revid, title, namespace key, catSet, page), like pages_from(),
+	but page is a list holding the whole text as a single string.
+	"""
+	last_id = None
+	for buf, start, end, base in scan_pages(input, block_size):
+		id, revid, title, ns, redirect, ts, te = page_fields(buf, start, end, namespaces)
+		if id != last_id and not redirect:
+			page = [] if ts is None or te is None else [buf[ts:te].decode('utf-8')]
+			yield (id, revid, title, ns, set(), page)
+			last_id = id
+
+
+def page_metadata(input, block_size=None):
+	"""
+	Scans the binary stream :param input: for the metadata of its pages,
+	without decoding any text.
+	:return: (id, revid, title, namespace key, size) for the same pages
+	pages_from_bytes() yields, where size is the length in bytes of the text,
+	from the bytes attribute of <text> when the dump provides it.
+	"""
+	last_id = None
+	for buf, start, end, base in scan_pages(input, block_size):
+		id, revid, title, ns, redirect, ts, te = page_fields(buf, start, end, ())
+		if id == last_id or redirect:
+			continue
+		last_id = id
+		size = 0
+		if ts is not None:
+			s = buf.find(b'<text', start, ts)
+			m = textBytesRE.search(buf, s, ts)
+			if m:
+				size = int(m.group(1))
 			else:
-				if input_file == '-':
-					# can't scan then reset stdin; must error w/ suggestion to specify template_file
-					raise ValueError("to use templates with stdin dump, must supply explicit template-file")
-				logging.info("Preprocessing '%s' to collect template definitions: this may take some time.", input_file)
-				load_templates(input, template_file)
-				input.close()
-				input = fileinput.FileInput(input_file, openhook=fileinput.hook_compressed)
-		template_load_elapsed = default_timer() - template_load_start
-		logging.info("Loaded %d templates in %.1fs", len(options.templates), template_load_elapsed)
-
-	# process pages
-	logging.info("Starting page extraction from %s.", input_file)
-	extract_start = default_timer()
-
-	# Parallel Map/Reduce:
-	# - pages to be processed are dispatched to workers
-	# - a reduce process collects the results, sort them and print them.
-
-	process_count = max(1, process_count)
-	maxsize = 10 * process_count
-	# output queue
-	output_queue = Queue(maxsize=maxsize)
-
-	if out_file == '-':
-		out_file = None
-
-	worker_count = process_count
-
-	# load balancing
-	max_spool_length = 10000
-	spool_length = Value('i', 0, lock=False)
-
-	# reduce job that sorts and prints output
-	reduce = Process(target=reduce_process,
-					 args=(options, output_queue, spool_length,
-						   out_file, file_size, file_compress))
-	reduce.start()
-
-	# initialize jobs queue
-	jobs_queue = Queue(maxsize=maxsize)
-
-	# start worker processes
-	logging.info("Using %d extract processes.", worker_count)
-	workers = []
-	for i in range(worker_count):
-		extractor = Process(target=extract_process,
-							args=(options, i, jobs_queue, output_queue))
-		extractor.daemon = True  # only live while parent process lives
-		extractor.start()
-		workers.append(extractor)
+				size = buf.find(b'</text>', ts, end) - ts
+		yield id, revid, title, ns, size
 
-	# Mapper process
-	page_num = 0
-	for page_data in pages_from(input):
-		id, revid, title, ns, catSet, page = page_data
-		if keepPage(ns, catSet, page):
-			# slow down
-			delay = 0
-			if spool_length.value > max_spool_length:
-				# reduce to 10%
-				while spool_length.value > max_spool_length/10:
-					time.sleep(10)
-					delay += 10
-			if delay:
-				logging.info('Delay %ds', delay)
-			job = (id, revid, title, page, page_num)
-			jobs_queue.put(job) # goes to any available extract_process
-			page_num += 1
-		page = None				# free memory
 
-	input.close()
+# ----------------------------------------------------------------------
+# Memory-mapped dumps
 
-	# signal termination
-	for _ in workers:
-		jobs_queue.put(None)
-	# wait for workers to terminate
-	for w in workers:
-		w.join()
+# An uncompressed dump is mapped in memory and scanned in place: the text of
+# the pages is passed to the extract processes as offsets into the file,
+# which they map in turn, and decoded there.
 
-	# signal end of work to reduce process
-	output_queue.put(None)
-	# wait for it to finish
-	reduce.join()
+# Distance between releases of the pages of the mapping already scanned
+mapped_release_size = 4 << 20
 
-	extract_duration = default_timer() - extract_start
-	extract_rate = page_num / extract_duration
-	logging.info("Finished %d-process extraction of %d articles in %.1fs (%.1f art/s)",
-				 process_count, page_num, extract_duration, extract_rate)
-	logging.info("total of page: %d, total of articl page: %d; total of used articl page: %d" % (g_page_total, g_page_articl_total,g_page_articl_used_total))
+mapped_dumps = {}		# mappings of this process, by file name
+
+
+def mapped_dump(input_file):
+	"""
+	:return: a read only mmap of :param input_file:, shared by the callers
+		in this process.
+	"""
+	buf = mapped_dumps.get(input_file)
+	if buf is None:
+		with open(input_file, 'rb') as f:
+			buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		if hasattr(mmap, 'MADV_SEQUENTIAL'):
+			buf.madvise(mmap.MADV_SEQUENTIAL)
+		mapped_dumps[input_file] = buf
+	return buf
+
+
+def release_mapped(buf, start, end):
+	"""
+	Drops from this process the pages of :param buf: within [:param start:, :param end:),
+	which stay in the page cache and are mapped again if touched.
+	"""
+	if hasattr(mmap, 'MADV_DONTNEED'):
+		start -= start % mmap.PAGESIZE
+		if end > start:
+			buf.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+
+def is_mappable(input_file):
+	"""Whether :param input_file: is an uncompressed dump that can be memory-mapped."""
+	return (input_file != '-' and os.path.splitext(input_file)[1] not in ('.bz2', '.gz')
+			and os.path.isfile(input_file))
+
+
+class DumpSlice(object):
+	"""
+	The text of a page, left in the mapped dump file until it is needed.
+	"""
+
+	__slots__ = ('input_file', 'start', 'end')
+
+	def __init__(self, input_file, start, end):
+		self.input_file = input_file
+		self.start = start
+		self.end = end
+
+	def __getstate__(self):
+		return self.input_file, self.start, self.end
+
+	def __setstate__(self, state):
+		self.input_file, self.start, self.end = state
+
+	def decode(self):
+		"""Decode the text from the mapping, then release its pages."""
+		buf = mapped_dump(self.input_file)
+		with memoryview(buf) as view:
+			text = str(view[self.start:self.end], 'utf-8')
+		release_mapped(buf, self.start, self.end)
+		return text
+
+
+def pages_from_mapped(input_file, namespaces=None, start=0, positions=None):
+	"""
+	Scans the uncompressed dump :param input_file: mapped in memory.
+	:param namespaces: as in pages_from_bytes().
+	:param start: position where to start scanning.
+	:param positions: DumpPositions where to set the position of each page.
+	:return: (id, revid, title, namespace key, catSet, page), like
+	pages_from_bytes(), but page holds a DumpSlice instead of the text.
+	"""
+	buf = mapped_dump(input_file)
+	last_id = None
+	released = start
+	for buf, start, end, base in scan_pages(buf, start=start):
+		id, revid, title, ns, redirect, ts, te = page_fields(buf, start, end, namespaces)
+		if id != last_id and not redirect:
+			page = [] if ts is None or te is None else [DumpSlice(input_file, ts, te)]
+			if positions:
+				positions.current = start
+			yield (id, revid, title, ns, set(), page)
+			last_id = id
+		if start - released > mapped_release_size:
+			release_mapped(buf, released, start)
+			released = start
+
+
+def decode_page(page):
+	"""
+	:return: the lines of :param page:, decoding its DumpSlice if it has one.
+	"""
+	if page and isinstance(page[0], DumpSlice):
+		return [page[0].decode()]
+	return page
+
+
+# ----------------------------------------------------------------------
+# Multistream dumps
+
+# A pages-articles-multistream.xml.bz2 dump is a concatenation of bz2 streams:
+# the first one holds the <siteinfo> header, each of the others 100 pages.
+# The companion index file has a line offset:page_id:title for each page,
+# where offset is the position in the dump of the stream holding the page.
+
+def read_multistream_index(index_file, titles=None, unselected=None):
+	"""
+	:param titles: set of titles, whose streams are selected.
+	:param unselected: called with the id of each page in the streams not
+	selected by :param titles:.
+	:return: (offsets, selected), the sorted list of the stream offsets found
+	in :param index_file: and the set of the offsets selected by :param titles:.
+	"""
+	offsets = set()
+	selected = set()
+	stream = None
+	stream_ids = []		# of the pages in stream, whose lines are contiguous
+	with open_dump(index_file) as index:
+		for line in index:
+			offset = int(line[:line.index(b':')])
+			offsets.add(offset)
+			if titles and unselected:
+				if offset != stream:
+					if stream not in selected:
+						for id in stream_ids:
+							unselected(id)
+					stream, stream_ids = offset, []
+				stream_ids.append(line.split(b':', 2)[1].decode('utf-8'))
+			if titles and offset not in selected:
+				title = line.rstrip(b'\n').split(b':', 2)[2].decode('utf-8')
+				if unescape(title) in titles:
+					selected.add(offset)
+	if titles and unselected and stream not in selected:
+		for id in stream_ids:
+			unselected(id)
+	return sorted(offsets), selected
+
+
+def stream_spans(input_file, offsets):
+	"""
+	:return: the (start, end) spans of the streams at :param offsets: in :param input_file:.
+	"""
+	return list(zip(offsets, offsets[1:] + [os.path.getsize(input_file)]))
+
+
+def read_stream(input_file, start, end):
+	"""
+	Decompress the bz2 stream between bytes :param start: and :param end: of :param input_file:.
+	"""
+	with open(input_file, 'rb') as f:
+		f.seek(start)
+		return bz2.decompress(f.read(end - start))
+
+
+def stream_pages(span, namespaces=None):
+	"""
+	Decompress and scan one stream of a multistream dump, in a pool process.
+	:param span: (input_file, start, end) of the stream.
+	:param namespaces: as in pages_from_bytes().
+	:return: the list of pages in the stream, as yielded by pages_from_bytes().
+	"""
+	return list(pages_from_bytes(io.BytesIO(read_stream(*span)), namespaces=namespaces))
+
+
+def map_streams(input_file, spans, process_count, func):
+	"""
+	Applies :param func: to streams of the multistream dump :param input_file:
+	in a pool of :param process_count: processes.
+	:param spans: spans of the page streams, from stream_spans().
+	:param func: function of (input_file, start, end) of a stream.
+	:return: ((start, end), result) for each stream, in dump order.
+	"""
+	window = 4 * process_count		# streams processed ahead of the reader
+	pending = deque()
+	with Pool(process_count) as pool:
+		for span in spans:
+			pending.append((span, pool.apply_async(func, ((input_file,) + span,))))
+			if len(pending) >= window:
+				span, result = pending.popleft()
+				yield span, result.get()
+		while pending:
+			span, result = pending.popleft()
+			yield span, result.get()
+
+
+def pages_from_multistream(input_file, spans, process_count, namespaces=None, positions=None):
+	"""
+	Scans the multistream dump :param input_file:, decompressing its streams
+	in a pool of :param process_count: processes.
+	:param spans: spans of the page streams to scan, from stream_spans().
+	:param namespaces: as in pages_from_bytes().
+	:param positions: DumpPositions where to set the stream of each page.
+	:return: the pages in dump order, like pages_from_bytes().
+	"""
+	func = partial(stream_pages, namespaces=namespaces)
+	for span, pages in map_streams(input_file, spans, process_count, func):
+		if positions:
+			positions.current = span[0]
+		yield from pages
+
+
+# ----------------------------------------------------------------------
+# Dump parts
+
+# Large wikis are also dumped in parts, like pages-articles1.xml-p1p41242.bz2,
+# each a complete XML document holding a range of pages.
+
+def dump_parts(patterns):
+	"""
+	Expands the file names and glob :param patterns: into a list of dump parts.
+	The files matched by a pattern are sorted with their numbers compared by
+	value, so that pages-articles2 comes before pages-articles10.
+	"""
+	parts = []
+	for pattern in patterns:
+		if any(c in pattern for c in '*?['):
+			matches = glob.glob(pattern)
+			if not matches:
+				raise ValueError("no dump part matches '%s'" % pattern)
+			parts.extend(sorted(matches, key=lambda name: [int(t) if t.isdigit() else t
+															for t in re.split(r'(\d+)', name)]))
+		elif pattern != '-' and not os.path.exists(pattern):
+			raise ValueError("no dump part '%s'" % pattern)
+		else:
+			parts.append(pattern)
+	return parts
+
+
+def read_part(input_file, namespaces, queue, batch_size=100):
+	"""
+	Reader process scanning the dump part :param input_file:.
+	:param namespaces: as in pages_from_bytes().
+	:param queue: where to put the pages, in lists of :param batch_size:,
+		followed by None, also when the part cannot be read: the exit code
+		of the process then tells the failure.
+	"""
+	try:
+		with open_dump(input_file, pipelined=True) as input:
+			batch = []
+			for page_data in pages_from_bytes(input, namespaces=namespaces):
+				batch.append(page_data)
+				if len(batch) == batch_size:
+					queue.put(batch)
+					batch = []
+			if batch:
+				queue.put(batch)
+			if isinstance(getattr(input, 'raw', None), DecompressionPipe):
+				input.raw.log_timing(input_file, logging.DEBUG)
+	finally:
+		queue.put(None)
+
+
+def pages_from_parts(input_files, process_count, namespaces=None):
+	"""
+	Scans the dump parts :param input_files: with up to :param process_count:
+	reader processes running at once.
+	Each reader fills its own bounded queue, which is drained in turn, so
+	the pages come in the same order as reading the parts one after another.
+	:param namespaces: as in pages_from_bytes().
+	:return: the pages, like pages_from_bytes().
+	"""
+	parts = deque(input_files)
+	readers = deque()
+
+	def start_reader():
+		queue = Queue(maxsize=100)
+		part = parts.popleft()
+		reader = Process(target=read_part, args=(part, namespaces, queue))
+		reader.daemon = True
+		reader.start()
+		readers.append((reader, queue, part))
+
+	while parts and len(readers) < process_count:
+		start_reader()
+	while readers:
+		reader, queue, part = readers[0]
+		for batch in iter(queue.get, None):
+			yield from batch
+		reader.join()
+		if reader.exitcode:
+			raise RuntimeError("reader of the dump part '%s' failed with exit code %d" % (part, reader.exitcode))
+		readers.popleft()
+		if parts:
+			start_reader()
+
+
+# ----------------------------------------------------------------------
+# Dump index
+
+def page_locations(input, block_size=None):
+	"""
+	Locates the pages in the binary stream :param input:.
+	:return: (title, id, redirect, offset, length) for each page, where the
+	span starts at the line of <page> and ends after the line of </page>.
+	"""
+	for buf, start, end, base in scan_pages(input, block_size):
+		id, revid, title, ns, redirect, ts, te = page_fields(buf, start, end)
+		line_start = buf.rfind(b'\n', 0, start) + 1
+		line_end = buf.find(b'\n', end) + 1 or end + 7
+		yield title, int(id), redirect, base + line_start, line_end - line_start
+
+
+def stream_page_locations(span):
+	"""
+	Locates the pages in one stream of a multistream dump, in a pool process.
+	:param span: (input_file, start, end) of the stream.
+	:return: the list of page_locations() within the decompressed stream.
+	"""
+	return list(page_locations(io.BytesIO(read_stream(*span))))
+
+
+class DumpIndex(object):
+	"""
+	On-disk index mapping title and page id to the position of each page in
+	a dump, for random access to single pages.
+	Plain dumps are indexed by the byte span of the page; multistream dumps
+	by the span of the bz2 stream holding the page, together with the span
+	of the page within the decompressed stream.
+	"""
+
+	def __init__(self, index_file, input_file=None):
+		"""
+		:param index_file: the index, as written by DumpIndex.build().
+		:param input_file: the dump, if moved since indexing it.
+		"""
+		self.db = sqlite3.connect(index_file)
+		info = dict(self.db.execute('SELECT key, value FROM info'))
+		self.input_file = input_file or info['input_file']
+		self.size = int(info['size'])
+		self.mtime = float(info['mtime'])
+
+	@classmethod
+	def build(cls, input_file, index_file, multistream_index=None, process_count=1):
+		"""
+		Index the pages of :param input_file: with a pass over the whole dump.
+		:param multistream_index: index file of a multistream dump, required
+			for compressed dumps.
+		:param process_count: processes decompressing a multistream dump.
+		"""
+		if not multistream_index and os.path.splitext(input_file)[1] in ('.bz2', '.gz'):
+			raise ValueError("can only index plain or multistream dumps: %s" % input_file)
+		if os.path.exists(index_file):
+			os.remove(index_file)
+		start = default_timer()
+		db = sqlite3.connect(index_file)
+		db.execute('CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT)')
+		db.execute('CREATE TABLE pages (title TEXT, id INTEGER, redirect INTEGER, '
+				   'offset INTEGER, length INTEGER, stream INTEGER, stream_length INTEGER)')
+		stat = os.stat(input_file)
+		db.executemany('INSERT INTO info VALUES (?, ?)',
+					   [('input_file', os.path.abspath(input_file)), ('size', str(stat.st_size)),
+						('mtime', repr(stat.st_mtime))])
+		insert = 'INSERT INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)'
+		if multistream_index:
+			offsets, _ = read_multistream_index(multistream_index)
+			for (s, e), pages in map_streams(input_file, stream_spans(input_file, offsets), process_count,
+											 stream_page_locations):
+				db.executemany(insert, [page + (s, e - s) for page in pages])
+		else:
+			with open(input_file, 'rb') as input:
+				db.executemany(insert, (page + (-1, 0) for page in page_locations(input)))
+		db.execute('CREATE INDEX pages_title ON pages (title)')
+		db.execute('CREATE INDEX pages_id ON pages (id)')
+		count = db.execute('SELECT count(*) FROM pages').fetchone()[0]
+		db.commit()
+		db.close()
+		logging.info("Indexed %d pages of %s in %.1fs", count, input_file, default_timer() - start)
+		return cls(index_file)
+
+	def is_current(self):
+		"""Whether the dump is unchanged since it was indexed."""
+		try:
+			stat = os.stat(self.input_file)
+		except OSError:
+			return False
+		return stat.st_size == self.size and stat.st_mtime == self.mtime
+
+	def locate(self, title=None, id=None, redirects=True):
+		"""
+		Find the first page with :param title: or :param id:.
+		:param redirects: whether to consider redirect pages.
+		:return: (offset, length, stream, stream_length), or None if missing.
+		"""
+		if title is not None:
+			where, key = 'title = ?', title
+		else:
+			where, key = 'id = ?', int(id)
+		if not redirects:
+			where += ' AND redirect = 0'
+		return self.db.execute('SELECT offset, length, stream, stream_length FROM pages WHERE %s '
+							   'ORDER BY stream, offset LIMIT 1' % where, (key,)).fetchone()
+
+	def read_page(self, title=None, id=None, redirects=True):
+		"""
+		Read the page with :param title: or :param id: from the dump.
+		:return: the lines of the page, from <page> to </page>, as bytes;
+			None if missing.
+		"""
+		location = self.locate(title, id, redirects)
+		if not location:
+			return None
+		offset, length, stream, stream_length = location
+		if stream >= 0:
+			return read_stream(self.input_file, stream, stream + stream_length)[offset:offset + length]
+		with open(self.input_file, 'rb') as f:
+			f.seek(offset)
+			return f.read(length)
+
+	def close(self):
+		self.db.close()
+
+
+def kept_pages(pages, titles=None, counters=None, dropped=None):
+	"""
+	Filters :param pages: through keepPage() and, if given, the set of
+	:param titles:.
+	:param counters: mapper Counters of a PipelineStats.
+	:param dropped: called with the id of each page filtered out.
+	"""
+	for page_data in pages:
+		id, revid, title, ns, catSet, page = page_data
+		if counters:
+			counters.add('read_pages')
+			counters.add('read_bytes', page_text_size(page))
+		if (not titles or unescape(title) in titles) and keepPage(ns, catSet, page):
+			yield page_data
+		else:
+			if counters:
+				counters.add('filtered_pages')
+			if dropped:
+				dropped(id)
+
+
+class ArticleSpool(object):
+	"""
+	Temporary store for the articles read while collecting templates in the
+	same pass, replayed once all template definitions are known.
+	"""
+
+	def __init__(self, directory=None):
+		"""
+		:param directory: where to create the spool file, default the system
+			temporary directory.
+		"""
+		self.file = tempfile.TemporaryFile(dir=directory)
+		self.count = 0
+
+	def extend(self, pages):
+		for page_data in pages:
+			marshal.dump(page_data, self.file)
+			self.count += 1
+
+	@property
+	def size(self):
+		return self.file.tell()
+
+	def __iter__(self):
+		"""Replays the spooled pages, releasing the spool at the end."""
+		self.file.seek(0)
+		for _ in range(self.count):
+			yield marshal.load(self.file)
+		self.file.close()
+
+
+# Name of the manifest written in the output directory
+manifest_name = 'manifest.tsv'
+
+
+class PreviousOutput(object):
+	"""
+	The output of a previous extraction, described by its manifest, which has
+	a line id<TAB>revid<TAB>file<TAB>offset<TAB>length for each page, where
+	file is relative to the directory of the manifest and offset and length
+	refer to the uncompressed content of the file.
+	"""
+
+	def __init__(self, manifest_file):
+		self.directory = os.path.dirname(os.path.abspath(manifest_file))
+		self.pages = {}
+		with open(manifest_file, encoding='utf-8') as f:
+			for line in f:
+				id, revid, filename, offset, length = line.rstrip('\n').split('\t')
+				self.pages[id] = (revid, filename, int(offset), int(length))
+		self.filename = None	# file currently loaded
+		self.data = None
+		self.reused = self.changed = self.new = 0
+		self.skipped = set()	# pages still in the dump, but not extracted again
+
+	def skip(self, id):
+		"""
+		Count page :param id: of the dump as not deleted, though it is not
+		extracted again, being filtered out or not read.
+		"""
+		if id in self.pages:
+			self.skipped.add(id)
+
+	def text(self, id, revid):
+		"""
+		:return: the previous output of page :param id: if it was extracted
+			from the same :param revid:, else None.
+		"""
+		previous = self.pages.get(id)
+		if previous is None:
+			self.new += 1
+			return None
+		previous_revid, filename, offset, length = previous
+		if revid is None or revid != previous_revid:
+			self.changed += 1
+			return None
+		if filename != self.filename:
+			path = os.path.join(self.directory, filename)
+			with (bz2.BZ2File(path) if path.endswith('.bz2') else open(path, 'rb')) as f:
+				self.data = f.read()
+			self.filename = filename
+		self.reused += 1
+		return self.data[offset:offset + length].decode('utf-8')
+
+	@property
+	def deleted(self):
+		"""Number of previous pages that are no longer in the dump."""
+		return len(self.pages) - self.reused - self.changed - len(self.skipped)
+
+
+def read_siteinfo(input):
+	"""
+	Collect urlbase and namespaces from the <siteinfo> header of the dump.
+	:param input: binary stream positioned at the start of the dump, it is
+	consumed up to </siteinfo>.
+	"""
+	for line in input:
+		line = line.decode('utf-8')
+		m = tagRE.search(line)
+		if not m:
+			continue
+		tag = m.group(2)
+		if tag == 'base':
+			# discover urlbase from the xml dump file
+			# /mediawiki/siteinfo/base
+			base = m.group(3)
+			options.urlbase = base[:base.rfind("/")]
+		elif tag == 'namespace':
+			mk = keyRE.search(line)
+			if mk:
+				nsid = ''.join(mk.groups())
+			else:
+				nsid = ''
+			options.knownNamespaces[m.group(3)] = nsid
+			if re.search('key="10"', line):
+				options.templateNamespace = m.group(3)
+				options.templatePrefix = options.templateNamespace + ':'
+			elif re.search('key="828"', line):
+				options.moduleNamespace = m.group(3)
+				options.modulePrefix = options.moduleNamespace + ':'
+		elif tag == '/siteinfo':
+			break
+
+
+def process_dump(input_file, template_file, out_file, file_size, file_compress,
+				 process_count, index_file=None, titles=None, previous_manifest=None):
+	"""
+	:param input_file: name of the wikipedia dump file; '-' to read from stdin.
+		A list of names is read as the consecutive parts of a dump.
+	:param template_file: optional file with template definitions.
+	:param out_file: directory where to store extracted data, or '-' for stdout
+	:param file_size: max size of each extracted file, or None for no max (one file)
+	:param file_compress: whether to compress files with bzip.
+	:param process_count: number of extraction processes to spawn.
+	:param index_file: index of a multistream dump, whose streams are then
+		decompressed in parallel, like the parts in a list of :param input_file:.
+	:param titles: set of titles of the pages to extract, found through
+		:param index_file: so that only the streams holding them are read.
+	:param previous_manifest: manifest of a previous extraction, whose output
+		is copied for the pages whose revision did not change.
+	An uncompressed :param input_file: is memory-mapped, and read in place.
+	"""
+
+	parts = None
+	if isinstance(input_file, (list, tuple)):
+		if len(input_file) > 1:
+			parts = input_file
+		else:
+			input_file = input_file[0]
+	dump_name = "%s and %d more parts" % (parts[0], len(parts) - 1) if parts else input_file
+	# disambiguation pages are found in the text, so it must be decoded in the mapper
+	mapped = not parts and not index_file and is_mappable(input_file) and not options.filter_disambig_pages
+
+	previous = None
+	if previous_manifest:
+		if out_file != '-' and os.path.isdir(out_file) and os.path.samefile(os.path.dirname(os.path.abspath(previous_manifest)), out_file):
+			raise ValueError("the previous output cannot be overwritten by an incremental extraction")
+		previous = PreviousOutput(previous_manifest)
+		logging.info("Incremental extraction over the %d pages of %s", len(previous.pages), previous_manifest)
+	dropped = previous and previous.skip
+
+	decompress_count = options.decompress_processes or max(1, process_count // 4)
+	if index_file:
+		if input_file == '-' or parts:
+			raise ValueError("a multistream dump must be a single file")
+		# the pages of the streams left out are still in the dump
+		offsets, selected = read_multistream_index(index_file, titles, dropped)
+		spans = stream_spans(input_file, offsets)
+		if titles:
+			page_spans = [span for span in spans if span[0] in selected]
+			logging.info("Selected %d of %d streams for %d titles.", len(page_spans), len(spans), len(titles))
+		else:
+			page_spans = spans
+		logging.info("Reading %d streams with %d decompression processes.", len(page_spans), decompress_count)
+		input = io.BytesIO(read_stream(input_file, 0, offsets[0]))
+	elif parts:
+		if '-' in parts:
+			raise ValueError("dump parts cannot be read from stdin")
+		logging.info("Reading %d dump parts with %d reader processes.", len(parts), decompress_count)
+		input = open_dump(parts[0])		# for the siteinfo
+	else:
+		input = open_dump(input_file, pipelined=True)
+
+	# collect siteinfo
+	read_siteinfo(input)
+
+	executor = options.executor
+	if options.coordinator and executor != 'processes':
+		logging.warning("Remote extraction runs the processes executor")
+		executor = 'processes'
+	# the number of extract processes varies within scale, see WorkerPool.autoscale()
+	scale = options.autoscale
+	if scale and (options.coordinator or executor == 'inline'):
+		logging.warning("Remote or inline extraction is not scaled")
+		scale = None
+	if scale:
+		process_count = min(max(process_count, scale[0]), scale[1])
+	slot_count = max(1, scale[1] if scale else process_count)
+	stats = PipelineStats(0 if options.coordinator else slot_count)
+	reporter = None
+	if options.stats_file or options.stats_port:
+		reporter = StatsReporter(stats, options.stats_file, options.stats_port, options.stats_period)
+
+	spool = None
+	shared_templates = None
+	template_cache = shared_template_cache = None
+	try:
+		if options.expand_templates:
+			# preprocess
+			template_load_start = default_timer()
+			if options.template_db and os.path.exists(options.template_db):
+				logging.info("Using template database: %s", options.template_db)
+				use_template_db(options.template_db)
+			elif template_file and os.path.exists(template_file):
+				logging.info("Loading template definitions from: %s", template_file)
+				with open_dump(template_file) as file:
+					load_templates(file)
+			elif mapped and (template_file or options.template_db):
+				# a mapped dump is cheap to scan twice
+				logging.info("Collecting template definitions from '%s'", input_file)
+				for _ in collect_templates(pages_from_bytes(mapped_dump(input_file), namespaces=templateKeys),
+											template_file):
+					pass
+			elif template_file or options.template_db:
+				# Single pass: articles are set aside until all templates are defined
+				logging.info("Collecting template definitions from '%s', spooling articles: this may take some time.", dump_name)
+				if index_file:
+					pages = pages_from_multistream(input_file, spans, decompress_count, articleKeys | templateKeys)
+				elif parts:
+					pages = pages_from_parts(parts, decompress_count, articleKeys | templateKeys)
+				else:
+					pages = pages_from_bytes(input, namespaces=articleKeys | templateKeys)
+				spool = ArticleSpool(options.spool_dir)
+				spool.extend(kept_pages(collect_templates(pages, template_file), titles, stats.mapper, dropped))
+				logging.info("Spooled %d articles (%.1f MB)", spool.count, spool.size / 1024**2)
+			if options.template_db and not isinstance(options.templates, TemplateDB):
+				TemplateDB.write(options.template_db, options.templates, options.redirects)
+				use_template_db(options.template_db)
+			elif options.templates and not isinstance(options.templates, TemplateDB):
+				# The extract processes map a temporary database rather than each
+				# getting a copy of the dicts, pickled or forked and then unshared
+				# by reference counting.
+				shared_templates = share_templates()
+			template_load_elapsed = default_timer() - template_load_start
+			logging.info("Loaded %d templates in %.1fs", len(options.templates), template_load_elapsed)
+			if not options.coordinator:		# remote workers have caches of their own
+				if options.template_cache and executor == 'processes':
+					shared_template_cache = SharedTemplateCache(options.template_cache * 1024**2)
+				template_cache = options.templateCache = TemplateCache(options.template_cache_size, shared_template_cache)
+
+		# process pages
+		logging.info("Starting page extraction from %s.", dump_name)
+		extract_start = default_timer()
+
+		# Parallel Map/Reduce:
+		# - pages to be processed are dispatched to workers
+		# - a reduce process collects the results, sort them and print them.
+
+		# - with options.unordered, workers write their own shards instead.
+
+		process_count = max(1, process_count)
+		maxsize = 10 * process_count
+
+		if out_file == '-':
+			out_file = None
+		unordered = options.unordered and out_file
+		if options.unordered and not unordered:
+			logging.warning("Unordered output requires an output directory, writing in order")
+		ring_memory = options.shared_memory
+		if options.coordinator and (unordered or ring_memory):
+			logging.warning("Remote extract processes send their output through the coordinator, "
+							"in order and without shared memory")
+			unordered = False
+			ring_memory = 0
+		if ring_memory and executor != 'processes':
+			logging.warning("Shared memory rings are only used by extract processes")
+			ring_memory = 0
+
+		positions = resume = None
+		if options.checkpoint_period and out_file and not unordered:
+			positions = DumpPositions(max(1, options.reorder_pages // 256))
+		if options.resume:
+			if not positions:
+				raise ValueError("resuming requires checkpoints of the output, written in order to a directory")
+			resume = read_checkpoint(out_file)
+			if resume:
+				logging.info("Resuming from the checkpoint after page %d", resume['next_page'])
+			else:
+				logging.warning("No checkpoint in %s, starting from the beginning", out_file)
+
+		worker_count = process_count
+
+		# load balancing
+		flow = None if unordered else FlowControl(options.reorder_pages, options.reorder_memory * 1024**2)
+		if flow and resume:
+			flow.next_page.value = resume['next_page']
+		stats.flow = flow
+		page_time = Value('d', 0.0, lock=False)		# reported by the extract processes
+
+		input_ring = output_rings = None
+		if ring_memory and unordered:
+			logging.warning("Unordered output does not use shared memory")
+		elif ring_memory:
+			ring_size = ring_memory * 1024**2
+			input_ring = SharedRing(ring_size)
+			output_rings = [SharedRing(max(ring_size // slot_count, 1024**2)) for _ in range(slot_count)]
+			logging.info("Sending page text through %d MB shared memory rings.", options.shared_memory)
+
+		reduce = None
+		if unordered:
+			# for the pages that are not extracted
+			output_queue = ShardWriter(out_file, 'mapper', file_size, file_compress)
+		elif executor == 'inline':
+			# the mapper writes the output
+			output_queue = ReorderWriter(flow, out_file, file_size, file_compress, None, stats.writer,
+										 positions, resume)
+		else:
+			# output queue
+			output_queue = ThreadQueue(maxsize=maxsize) if executor == 'threads' else ResultQueue(maxsize)
+			# reduce job that sorts and prints output
+			args = (options, output_queue, flow, out_file, file_size, file_compress,
+					output_rings and (input_ring, output_rings), stats.writer, positions, resume,
+					executor != 'threads')
+			if executor == 'threads':
+				reduce = ProcessThread(reduce_process, args)
+			else:
+				reduce = Process(target=reduce_process, args=args)
+			reduce.start()
+
+		# start worker processes
+		quarantine_file = options.quarantine_file
+		if not quarantine_file and out_file:
+			quarantine_file = os.path.join(out_file, 'quarantine.tsv')
+		if options.coordinator:
+			workers = RemoteWorkerPool(output_queue, page_time, quarantine_file, stats)
+		elif executor == 'inline':
+			logging.info("Extracting inline.")
+			workers = InlinePool(output_queue, page_time, (out_file, file_size, file_compress) if unordered else None,
+								 stats)
+		else:
+			kind = 'threads' if executor == 'threads' else 'processes'
+			if scale:
+				logging.info("Using %d extract %s, scaling between %d and %d.", worker_count, kind, *scale)
+			else:
+				logging.info("Using %d extract %s.", worker_count, kind)
+			workers = WorkerPool(worker_count, output_queue, page_time,
+								 output_rings and (input_ring, output_rings), quarantine_file,
+								 (out_file, file_size, file_compress) if unordered else None, stats, scale,
+								 executor == 'threads', flow and flow.next_page)
+
+		# Mapper process
+		page_num = 0
+		position = None
+		if resume and resume['position'] and spool is None and (index_file or mapped):
+			# read from the position of a page before the checkpoint
+			page_num, position = resume['position']
+		resume_page = resume['next_page'] if resume else 0
+		if spool is not None:
+			pages = spool
+		elif index_file:
+			if position is not None:
+				page_spans = [span for span in page_spans if span[0] >= position]
+			pages = kept_pages(pages_from_multistream(input_file, page_spans, decompress_count, articleKeys,
+													  positions), titles, stats.mapper, dropped)
+		elif parts:
+			pages = kept_pages(pages_from_parts(parts, decompress_count, articleKeys), titles, stats.mapper, dropped)
+		elif mapped:
+			pages = kept_pages(pages_from_mapped(input_file, articleKeys, position or 0, positions),
+							   titles, stats.mapper, dropped)
+		else:
+			pages = kept_pages(pages_from_bytes(input, namespaces=articleKeys), titles, stats.mapper, dropped)
+		batcher = JobBatcher(workers, output_queue, flow, page_time, input_ring, stats.mapper)
+		lookahead = None
+		if options.lookahead and flow and not input_ring and executor != 'inline':
+			# pages held back in shared memory could stall the reduce process, and
+			# the inline executor extracts the pages in order anyway
+			batcher = lookahead = LookAhead(batcher, options.lookahead)
+		split_size = 0
+		if options.split_languages and flow and not input_ring:
+			# the reduce process merges the parts
+			split_size = options.split_languages * 1024
+		split_pages = split_parts = 0
+		mismatch = False
+		for page_data in pages:
+			id, revid, title, ns, catSet, page = page_data
+			if positions:
+				positions.update(page_num)
+			if page_num < resume_page:
+				# written before the checkpoint
+				if page_num == resume_page - 1 and id != resume['last_id']:
+					logging.error("Page %d is %s, rather than %s as in the checkpoint", page_num, id, resume['last_id'])
+					mismatch = True
+					break
+				if previous:
+					previous.skip(id)
+				page_num += 1
+				continue
+			if previous:
+				text = previous.text(id, revid)
+				if text is not None:
+					# unchanged page, bypasses the extract processes
+					batcher.add_result((page_num, id, revid, text, None))
+					page_num += 1
+					continue
+			if split_size and page_text_size(page) >= split_size:
+				page = decode_page(page)
+				parts = language_parts(''.join(page))
+				if len(parts) > 1:
+					for i, text in enumerate(parts):
+						batcher.add((id, revid, title, [text], page_num, (i, len(parts))), len(text))
+					split_pages += 1
+					split_parts += len(parts)
+					page_num += 1
+					page = parts = text = None
+					continue
+			job = (id, revid, title, page, page_num, None)
+			batcher.add(job, page_size(page))
+			page_num += 1
+			page = None				# free memory
+		batcher.flush()
+		if split_size:
+			logging.info("Split %d pages into %d language parts", split_pages, split_parts)
+		logging.info("Dispatched %d batches, last of %d pages", batcher.batches, batcher.batch_pages)
+		if lookahead:
+			logging.info("Dispatched %d expensive pages early, up to %d pages ahead, %d more without room "
+						 "in the reorder buffer; output stall avoided at most %.1fs", lookahead.early,
+						 lookahead.farthest, lookahead.declined, lookahead.saved)
+
+		if isinstance(getattr(input, 'raw', None), DecompressionPipe):
+			input.raw.log_timing(input_file)
+		input.close()
+
+		# signal termination and wait for workers to terminate
+		workers.close()
+
+		if unordered:
+			output_queue.close()
+			logging.info("Wrote %d pages to %d shards", merge_shard_manifests(out_file), workers.shard_count)
+		else:
+			if reduce:
+				# signal end of work to reduce process
+				output_queue.put(None)
+				# wait for it to finish
+				reduce.join()
+			else:
+				output_queue.close()
+			checkpoint = out_file and os.path.join(out_file, checkpoint_name)
+			if checkpoint and not mismatch and (not reduce or reduce.exitcode == 0) and os.path.exists(checkpoint):
+				# complete, nothing to resume
+				os.remove(checkpoint)
+		if input_ring:
+			logging.info("Mapper waited %.1fs for room in the shared memory ring", batcher.ring_wait_time)
+			for ring in [input_ring] + output_rings:
+				ring.close()
+	finally:
+		# removed also on failure, being the size of all the templates
+		if shared_templates:
+			options.templates.close()
+			os.remove(shared_templates)
+		if shared_template_cache:
+			shared_template_cache.close()
+
+	extract_duration = default_timer() - extract_start
+	extract_rate = page_num / extract_duration
+	logging.info("Finished %s extraction of %d articles in %.1fs (%.1f art/s)",
+				 'remote' if options.coordinator else 'inline' if executor == 'inline' else
+				 '%d-%s' % (process_count, 'thread' if executor == 'threads' else 'process'),
+				 page_num, extract_duration, extract_rate)
+	if flow:
+		logging.info("Mapper throttled by the reorder buffer for %.1fs", flow.wait_time)
+	busy = stats.snapshot()['busy_seconds']
+	logging.info("Mapper waited %.1fs to queue pages, extract processes busy %.1fs, %.0f%% of the extraction",
+				 stats.mapper['queue_wait_seconds'], busy,
+				 100 * busy / (extract_duration * max(1, len(stats.workers) or len(stats.remote))))
+	if reporter:
+		reporter.close()
+	if template_cache:
+		hits, shared_hits, misses, evictions = template_cache.stats
+		lookups = max(1, hits + shared_hits + misses)
+		logging.info("Template cache: %d lookups, %.1f%% hits, %.1f%% from other processes, %.1f%% parsed, "
+					 "%d evicted, shared cache cleared %d times", hits + shared_hits + misses,
+					 100 * hits / lookups, 100 * shared_hits / lookups, 100 * misses / lookups, evictions,
+					 shared_template_cache.clears.value if shared_template_cache else 0)
+	logging.info("total of page: %d, total of articl page: %d; total of used articl page: %d" % (g_page_total, g_page_articl_total,g_page_articl_used_total))
+	if previous:
+		# resuming from a position, the pages before it were not read
+		logging.info("Reused %d unchanged pages, extracted %d changed and %d new pages, %s",
+					 previous.reused, previous.changed, previous.new,
+					 "%d pages deleted" % previous.deleted if position is None else "deleted pages not counted")
+	if mismatch:
+		raise ValueError("the dump does not match the checkpoint in %s" % out_file)
 
 
 # ----------------------------------------------------------------------
 # Multiprocess support
 
 
-def extract_process(opts, i, jobs_queue, output_queue):
-	"""Pull tuples of raw page content, do CPU/regex-heavy fixup, push finished text
+class SharedRing(object):
+	"""
+	Ring buffer in shared memory, where one process writes records that
+	another releases in the same order.
+	Positions grow without bound, and are taken modulo the size.
+	"""
+
+	def __init__(self, size):
+		self.shm = shared_memory.SharedMemory(create=True, size=size)
+		self.size = size
+		self.head = 0							# next free position, in the writer
+		self.tail = Value('q', 0, lock=False)	# released up to, by the reader
+
+	def allocate(self, length):
+		"""
+		:return: the position of a free record of :param length: bytes, or None
+			if it does not fit now.
+		"""
+		start = self.head
+		if start % self.size + length > self.size:	# records do not wrap
+			start += self.size - start % self.size
+		if start + length - self.tail.value > self.size:
+			return None
+		self.head = start + length
+		return start
+
+	def write(self, data, ring=0):
+		"""
+		:return: a RingSlice with :param data:, or None if there is no room.
+		"""
+		start = self.allocate(len(data))
+		if start is None:
+			return None
+		self.shm.buf[start % self.size:start % self.size + len(data)] = data
+		return RingSlice(start, len(data), ring)
+
+	def view(self, slice):
+		""":return: a memoryview of :param slice:, to be released by the caller."""
+		start = slice.start % self.size
+		return self.shm.buf[start:start + slice.length]
+
+	def release(self, end):
+		"""Releases the records before position :param end:."""
+		self.tail.value = end
+
+	def close(self):
+		self.shm.close()
+		self.shm.unlink()
+
+
+class RingSlice(object):
+	"""
+	Descriptor of a record in a SharedRing.
+	"""
+
+	__slots__ = ('start', 'length', 'ring')
+
+	def __init__(self, start, length, ring=0):
+		"""
+		:param ring: index of the ring, among the output rings.
+		"""
+		self.start = start
+		self.length = length
+		self.ring = ring
+
+	def __getstate__(self):
+		return self.start, self.length, self.ring
+
+	def __setstate__(self, state):
+		self.start, self.length, self.ring = state
+
+	def __len__(self):
+		return self.length
+
+	@property
+	def end(self):
+		return self.start + self.length
+
+
+class FlowControl(object):
+	"""
+	Limits the pages the mapper dispatches ahead of the reduce process, both
+	in number and in size of the extracted pages held in the reorder buffer.
+	The mapper waits on a condition, which the reduce process notifies as
+	soon as it writes pages, but never for the page the reduce process needs
+	next: pages dispatched early may have filled the buffer ahead of it.
+	"""
+
+	def __init__(self, max_pages, max_bytes):
+		"""
+		:param max_pages: pages dispatched and not yet written.
+		:param max_bytes: size of the pages in the reorder buffer.
+		"""
+		self.max_pages = max_pages
+		self.max_bytes = max_bytes
+		self.condition = Condition()
+		self.pending = Value('l', 0, lock=False)		# guarded by condition
+		self.buffered = Value('q', 0, lock=False)
+		self.next_page = Value('q', 0, lock=False)	# the page the reduce process waits for
+		self.wait_time = 0.0	# in the mapper
+
+	def full(self, first_page=None):
+		""":return: whether the mapper must wait to dispatch pages from :param first_page: on."""
+		if first_page is not None and first_page <= self.next_page.value:
+			return False
+		return self.pending.value >= self.max_pages or self.buffered.value > self.max_bytes
+
+	def acquire(self, pages=1, first_page=None):
+		"""
+		Called by the mapper before dispatching :param pages:, from
+		:param first_page: on.
+		"""
+		with self.condition:
+			if self.full(first_page):
+				start = default_timer()
+				while self.full(first_page):
+					self.condition.wait()
+				self.wait_time += default_timer() - start
+			self.pending.value += pages
+
+	def try_acquire(self, pages=1):
+		"""
+		Called by the mapper before dispatching :param pages: ahead of
+		others, which it cannot wait for.
+		:return: whether there was room for them.
+		"""
+		with self.condition:
+			if self.pending.value + pages > self.max_pages or self.buffered.value > self.max_bytes:
+				return False
+			self.pending.value += pages
+			return True
+
+	def update(self, written, buffered, next_page=None):
+		"""
+		Called by the reduce process.
+		:param written: number of pages written since the last update.
+		:param buffered: size of the pages in the reorder buffer.
+		:param next_page: the page it waits for.
+		"""
+		with self.condition:
+			self.pending.value -= written
+			self.buffered.value = buffered
+			if next_page is not None:
+				self.next_page.value = next_page
+			if written:
+				self.condition.notify()
+
+
+class ResultQueue(object):
+	"""
+	The output queue of the extract processes, bounded to :param maxsize:
+	messages. Unlike a Queue, whose feeder thread may still hold them when
+	the process dies, put() returns once the results are in the pipe.
+	"""
+
+	def __init__(self, maxsize):
+		self.maxsize = maxsize
+		self.queue = SimpleQueue()
+		self.room = Semaphore(maxsize)
+
+	def put(self, obj):
+		self.room.acquire()
+		self.queue.put(obj)
+
+	def get(self):
+		obj = self.queue.get()
+		self.room.release()
+		return obj
+
+	def qsize(self):
+		# raises NotImplementedError where semaphores have no value, like Queue
+		return self.maxsize - self.room.get_value()
+
+
+class DumpPositions(object):
+	"""
+	Positions in the dump where the mapper can start reading again, so that
+	it reaches the pages after a checkpoint without scanning the pages before.
+	The reader sets :attr current: to the position of each page it yields,
+	the position of its stream in a multistream dump, and the mapper records
+	(page_num, position) of the first page read from a position, once every
+	:attr stride: pages, in a ring shared with the reduce process and
+	written without lock.
+	"""
+
+	size = 1024			# entries in the ring
+
+	def __init__(self, stride):
+		self.stride = stride
+		self.entries = Array('q', 2 * self.size, lock=False)
+		self.count = Value('q', 0, lock=False)
+		self.current = None		# position of the page being read
+		self.last = None			# in the mapper
+		self.last_page = -stride
+
+	def update(self, page_num):
+		"""Called by the mapper for each page, once the reader set :attr current:."""
+		if self.current == self.last:
+			return
+		self.last = self.current
+		if self.current is not None and page_num - self.last_page >= self.stride:
+			i = self.count.value % self.size
+			self.entries[2 * i] = page_num
+			self.entries[2 * i + 1] = self.current
+			self.count.value += 1		# the entry is complete
+			self.last_page = page_num
+
+	def find(self, page_num):
+		"""
+		Called by the reduce process.
+		:return: the last (page_num, position) recorded at or before
+			:param page_num:, or None.
+		"""
+		count = self.count.value
+		# skips the oldest entries, which the mapper may be overwriting
+		for n in range(count - 1, max(count - self.size + 16, 0) - 1, -1):
+			i = n % self.size
+			if self.entries[2 * i] <= page_num:
+				return self.entries[2 * i], self.entries[2 * i + 1]
+		return None
+
+
+# Name of the checkpoint written in the output directory
+checkpoint_name = 'checkpoint.json'
+
+
+def write_checkpoint(out_file, output, manifest, state):
+	"""
+	Make the output and the manifest durable, then record in the checkpoint
+	file :param state: along with where to resume them.
+	"""
+	state['file_index'] = (output.nextFile.dir_index, output.nextFile.file_index)
+	state['file_size'], state['file_offset'] = output.checkpoint()
+	manifest.flush()
+	os.fsync(manifest.fileno())
+	state['manifest_size'] = os.fstat(manifest.fileno()).st_size
+	path = os.path.join(out_file, checkpoint_name)
+	# replaced at once, so that a crash leaves the previous checkpoint
+	with open(path + '.tmp', 'w') as f:
+		json.dump(state, f)
+		f.flush()
+		os.fsync(f.fileno())
+	os.replace(path + '.tmp', path)
+
+
+def read_checkpoint(out_file):
+	""":return: the state of the checkpoint in :param out_file:, or None if there is none."""
+	path = os.path.join(out_file, checkpoint_name)
+	if not os.path.exists(path):
+		return None
+	with open(path) as f:
+		return json.load(f)
+
+
+class JobBatcher(object):
+	"""
+	Groups the jobs for the extract processes into messages of up to
+	options.batch_pages pages or options.batch_bytes of text, sized so that
+	each takes about options.batch_time to extract, after the time per page
+	the extract processes report.
+	"""
+
+	initial_pages = 10			# batch size until the first report
+
+	def __init__(self, jobs_queue, output_queue, flow, page_time, ring=None, counters=None):
+		"""
+		:param jobs_queue: where to put the batches, a queue or a WorkerPool.
+		:param page_time: shared Value with the recent extraction time per page.
+		:param ring: SharedRing where to put the text of the pages, which the
+			jobs then carry as a RingSlice.
+		:param counters: mapper Counters of a PipelineStats.
+		"""
+		self.jobs_queue = jobs_queue
+		self.output_queue = output_queue
+		self.flow = flow
+		self.page_time = page_time
+		self.ring = ring
+		self.counters = counters
+		self.ring_wait_time = 0.0
+		self.jobs = []
+		self.size = 0
+		self.results = []		# pages that need no extraction
+		self.batches = 0
+		self.batch_pages = self.initial_pages
+
+	def add(self, job, size):
+		""":param size: size of the text of the page in :param job:."""
+		id, revid, title, page, page_num, part = job
+		if self.ring and page and not isinstance(page[0], DumpSlice):
+			page = self.put_in_ring(''.join(page).encode('utf-8'))
+			if page:
+				job = (id, revid, title, page, page_num, part)
+				size = 0
+		self.jobs.append(job)
+		self.size += size
+		if len(self.jobs) + len(self.results) >= self.batch_pages or self.size >= options.batch_bytes:
+			self.flush()
+
+	def put_in_ring(self, data):
+		"""
+		Writes :param data: in the ring, waiting for room if needed.
+		:return: the page holding the RingSlice, or None if :param data: is
+			too large for the ring.
+		"""
+		if len(data) > self.ring.size // 2:
+			return None
+		slice = self.ring.write(data)
+		if slice is None:
+			# the reduce process releases room as it writes pages, which it
+			# can only do once the pages batched so far are dispatched
+			self.flush()
+			start = default_timer()
+			with self.flow.condition:
+				while slice is None:
+					self.flow.condition.wait(1)
+					slice = self.ring.write(data)
+			self.ring_wait_time += default_timer() - start
+		return [slice]
+
+	def add_result(self, result):
+		"""
+		:param result: (page_num, id, revid, text, None) of a page that
+			bypasses the extract processes.
+		"""
+		self.results.append(result)
+		if len(self.jobs) + len(self.results) >= self.batch_pages:
+			self.flush()
+
+	def flush(self):
+		"""Dispatch the batched jobs, and adapt the size of the next batch."""
+		# the flow control does not wait when the reduce process waits for
+		# one of these pages, whatever the pages dispatched early hold
+		start = default_timer()
+		if self.flow:
+			first_page = min([job[4] for job in self.jobs] + [result[0] for result in self.results], default=None)
+			self.flow.acquire(job_pages(self.jobs) + len(self.results), first_page)
+		if self.jobs:
+			self.jobs_queue.put(self.jobs)  # goes to any available extract_process
+			self.batches += 1
+		if self.results:
+			self.output_queue.put(self.results)
+		if self.counters:
+			self.counters.add('queue_wait_seconds', default_timer() - start)
+			self.counters.add('queued_pages', job_pages(self.jobs) + len(self.results))
+			self.counters.add('queued_batches', 1 if self.jobs else 0)
+		self.jobs = []
+		self.results = []
+		self.size = 0
+		page_time = self.page_time.value
+		if page_time > 0:
+			self.batch_pages = max(1, min(options.batch_pages, int(options.batch_time / page_time)))
+
+	def dispatch_early(self, job):
+		"""
+		Dispatch :param job: alone, ahead of the jobs before it, if the flow
+		control has room for it.
+		:return: whether it was dispatched.
+		"""
+		if self.flow and not self.flow.try_acquire(job_pages([job])):
+			return False
+		start = default_timer()
+		self.jobs_queue.put([job])
+		self.batches += 1
+		if self.counters:
+			self.counters.add('queue_wait_seconds', default_timer() - start)
+			self.counters.add('queued_pages', job_pages([job]))
+			self.counters.add('queued_batches')
+		return True
+
+
+def job_key(job):
+	""":return: (page_num, part index or -1) of :param job:, telling apart the parts of a page."""
+	return (job[4], job[5][0] if job[5] else -1)
+
+
+def job_pages(jobs):
+	"""Number of pages in :param jobs:, where a page split in parts counts with its first part."""
+	return sum(1 for job in jobs if not job[5] or job[5][0] == 0)
+
+
+class LookAhead(object):
+	"""
+	Holds the next :param size: pages of the mapper, to dispatch at once the
+	expensive ones, so that their extraction, which may take longer than that
+	of all the pages before them, is done by the time the reduce process
+	needs them. The other pages go on to the JobBatcher in order.
+	"""
+
+	def __init__(self, batcher, size):
+		self.batcher = batcher
+		self.size = size
+		self.window = deque()	# (job, size, cost), (None, result, None), or the (page_num, time, cost) of an early page
+		self.pages = 0
+		self.total_cost = 0
+		self.early = 0
+		self.declined = 0		# expensive pages the flow control had no room for
+		self.farthest = 0		# pages ahead of the reduce process
+		self.saved = 0.0		# upper bound of the head-of-line stall avoided
+
+	def add(self, job, size):
+		"""Same as JobBatcher.add()."""
+		cost = page_cost(job[3])
+		self.pages += 1
+		self.total_cost += cost
+		average = self.total_cost / self.pages
+		if cost >= options.lookahead_min_cost and cost >= options.lookahead_factor * average:
+			if self.batcher.dispatch_early(job):
+				logging.debug("Dispatching page %d %s early: cost %d, %.0f times the average, %d pages ahead",
+							  job[4], job[2], cost, cost / average, len(self.window))
+				self.early += 1
+				self.farthest = max(self.farthest, len(self.window))
+				self.window.append((job[4], default_timer(), cost))
+				self.advance()
+				return
+			self.declined += 1
+		self.window.append((job, size, cost))
+		self.advance()
+
+	def add_result(self, result):
+		"""Same as JobBatcher.add_result()."""
+		self.window.append((None, result, None))
+		self.advance()
+
+	def advance(self, pages=None):
+		"""Passes the pages beyond the window to the batcher."""
+		while len(self.window) > (self.size if pages is None else pages):
+			job, size, cost = self.window.popleft()
+			if job is None:
+				self.batcher.add_result(size)
+			elif isinstance(job, tuple):
+				self.batcher.add(job, size)
+			else:
+				# an early page, that would have been dispatched now: its
+				# extraction would have stalled the output for up to its duration
+				lead = default_timer() - size
+				page_time = self.batcher.page_time.value
+				duration = page_time * cost * self.pages / self.total_cost
+				self.saved += min(lead, duration)
+
+	def flush(self):
+		"""Same as JobBatcher.flush()."""
+		self.advance(0)
+		self.batcher.flush()
+
+	@property
+	def batches(self):
+		return self.batcher.batches
+
+	@property
+	def batch_pages(self):
+		return self.batcher.batch_pages
+
+
+def page_cost(page):
+	"""
+	Estimate of the cost of extracting :param page:, the size of its text
+	plus options.template_cost for each template call, when templates are
+	expanded.
+	"""
+	template_cost = options.template_cost if options.expand_templates else 0
+	if page and isinstance(page[0], DumpSlice):
+		if not template_cost:
+			return page[0].end - page[0].start
+		buf = mapped_dump(page[0].input_file)
+		return page[0].end - page[0].start + template_cost * buf[page[0].start:page[0].end].count(b'{{')
+	if not template_cost:
+		return sum(len(line) for line in page)
+	return sum(len(line) + template_cost * line.count('{{') for line in page)
+
+
+def page_text_size(page):
+	"""Size of the text of :param page:, in the job or in the mapped dump."""
+	if page and isinstance(page[0], DumpSlice):
+		return page[0].end - page[0].start
+	return page_size(page)
+
+
+def page_size(page):
+	"""Size of the text of :param page: carried in a job."""
+	if page and isinstance(page[0], DumpSlice):
+		return 0
+	return sum(len(line) for line in page)
+
+
+class Counters(object):
+	"""
+	Named counters in shared memory, each set updated by a single process,
+	without lock.
+	"""
+
+	def __init__(self, names):
+		self.names = names
+		self.values = Array('d', len(names), lock=False)
+
+	def add(self, name, value=1):
+		self.values[self.names.index(name)] += value
+
+	def __getitem__(self, name):
+		return self.values[self.names.index(name)]
+
+	def items(self):
+		return zip(self.names, self.values)
+
+
+class PipelineStats(object):
+	"""
+	Counters of the stages of process_dump(): the mapper reading and
+	dispatching pages, each extract process, and the reduce process writing
+	their output (not counted with --unordered, where the extract processes
+	write).
+	"""
+
+	mapper_counters = ('read_pages', 'read_bytes', 'filtered_pages', 'queued_pages', 'queued_batches',
+					   'queue_wait_seconds')
+	worker_counters = ('extracted_pages', 'busy_seconds', 'template_title_errors',
+					   'template_recursion_errors', 'template_call_recursion_errors',
+					   'parameter_recursion_errors')
+	writer_counters = ('written_pages', 'written_bytes')
+
+	def __init__(self, worker_count):
+		self.start = default_timer()
+		self.mapper = Counters(self.mapper_counters)
+		self.workers = [Counters(self.worker_counters) for _ in range(worker_count)]
+		self.writer = Counters(self.writer_counters)
+		self.remote = {}		# worker counters of the remote extract processes, by connection
+		self.flow = None
+
+	def snapshot(self):
+		""":return: a dict of the counters, with the totals of the extract processes and the rates."""
+		elapsed = default_timer() - self.start
+		stats = {'elapsed_seconds': elapsed}
+		stats.update(self.mapper.items())
+		stats.update(self.writer.items())
+		workers = [dict(counters.items()) for counters in self.workers]
+		workers.extend(dict(zip(self.worker_counters, values)) for values in list(self.remote.values()))
+		for name in self.worker_counters:
+			stats[name] = sum(worker[name] for worker in workers)
+		for worker in workers:
+			worker['busy_ratio'] = worker['busy_seconds'] / elapsed if elapsed else 0.0
+		stats['workers'] = workers
+		if self.flow:
+			stats['reorder_pending_pages'] = self.flow.pending.value
+			stats['reorder_buffered_bytes'] = self.flow.buffered.value
+		for name in ('read_pages', 'extracted_pages', 'written_pages', 'written_bytes'):
+			stats[name + '_per_second'] = stats[name] / elapsed if elapsed else 0.0
+		return stats
+
+	def prometheus(self):
+		""":return: the snapshot() in the Prometheus text format."""
+		stats = self.snapshot()
+		lines = []
+		for name, value in stats.items():
+			if name == 'workers':
+				continue
+			kind = 'counter' if name in self.mapper_counters + self.worker_counters + self.writer_counters else 'gauge'
+			metric = 'wikiextractor_' + name + ('_total' if kind == 'counter' else '')
+			lines.append('# TYPE %s %s' % (metric, kind))
+			lines.append('%s %s' % (metric, value))
+		for name in self.worker_counters + ('busy_ratio',):
+			metric = 'wikiextractor_worker_' + name + ('' if name == 'busy_ratio' else '_total')
+			lines.append('# TYPE %s %s' % (metric, 'gauge' if name == 'busy_ratio' else 'counter'))
+			for i, worker in enumerate(stats['workers']):
+				lines.append('%s{worker="%d"} %s' % (metric, i, worker[name]))
+		return '\n'.join(lines) + '\n'
+
+
+def count_template_errors(counters, extractor):
+	"""Add the template errors of :param extractor: to the :param counters: of its process."""
+	counters.add('template_title_errors', extractor.template_title_errs)
+	counters.add('template_recursion_errors', extractor.recursion_exceeded_1_errs)
+	counters.add('template_call_recursion_errors', extractor.recursion_exceeded_2_errs)
+	counters.add('parameter_recursion_errors', extractor.recursion_exceeded_3_errs)
+
+
+class StatsReporter(object):
+	"""
+	Writes the PipelineStats as JSON to :param stats_file: every
+	:param period: seconds, and serves them on :param port: of localhost in
+	the Prometheus text format.
+	"""
+
+	def __init__(self, stats, stats_file=None, port=0, period=10):
+		self.stats = stats
+		self.stats_file = stats_file
+		self.period = period
+		self.server = None
+		if port:
+			class Handler(BaseHTTPRequestHandler):
+				def do_GET(handler):
+					body = stats.prometheus().encode('utf-8')
+					handler.send_response(200)
+					handler.send_header('Content-Type', 'text/plain; version=0.0.4')
+					handler.send_header('Content-Length', str(len(body)))
+					handler.end_headers()
+					handler.wfile.write(body)
+
+				def log_message(handler, format, *args):
+					pass
+			self.server = ThreadingHTTPServer(('localhost', port), Handler)
+			self.server.daemon_threads = True
+			threading.Thread(target=self.server.serve_forever, daemon=True).start()
+			logging.info("Serving statistics on http://localhost:%d/metrics", self.server.server_address[1])
+		self.finished = threading.Event()
+		self.writer = None
+		if stats_file:
+			self.writer = threading.Thread(target=self.write_periodically, daemon=True)
+			self.writer.start()
+
+	def write(self):
+		# replaced at once, never seen half written
+		with open(self.stats_file + '.tmp', 'w') as f:
+			json.dump(self.stats.snapshot(), f, indent=1)
+		os.replace(self.stats_file + '.tmp', self.stats_file)
+
+	def write_periodically(self):
+		while not self.finished.wait(self.period):
+			self.write()
+
+	def close(self):
+		"""Write the final statistics, and stop serving them."""
+		self.finished.set()
+		if self.writer:
+			self.writer.join()
+			self.write()
+		if self.server:
+			self.server.shutdown()
+			self.server.server_close()
+
+
+class CpuUsage(object):
+	"""
+	Busy fraction of the CPUs between calls, from /proc/stat, or from the load
+	average where there is none.
+	"""
+
+	def __init__(self):
+		self.last = self.read()
+
+	@staticmethod
+	def read():
+		""":return: the total and idle CPU time, or None."""
+		try:
+			with open('/proc/stat') as f:
+				times = [int(t) for t in f.readline().split()[1:]]
+			return sum(times), times[3] + times[4]	# idle and iowait
+		except (OSError, ValueError, IndexError):
+			return None
+
+	def busy(self):
+		""":return: the busy fraction of the CPUs since the last call."""
+		last, self.last = self.last, self.read()
+		if last and self.last and self.last[0] > last[0]:
+			return 1 - (self.last[1] - last[1]) / (self.last[0] - last[0])
+		try:
+			return min(1.0, os.getloadavg()[0] / cpu_count())
+		except (AttributeError, OSError):
+			return 0.0
+
+
+class WorkerStatus(object):
+	"""
+	Progress of the extract processes, shared with the WorkerPool supervising them.
+	"""
+
+	def __init__(self, count):
+		self.condition = Condition()		# notified when a batch is done
+		self.lock = Lock()					# the page in progress changes, or is timed out
+		self.done = Array('q', count, lock=False)		# batches completed
+		self.sent = Array('q', count, lock=False)		# pages of the current batch sent out
+		self.current = Array('q', [-1] * count, lock=False)	# page in progress, -1 if none
+		self.part = Array('q', [-1] * count, lock=False)		# its part, -1 if whole
+		self.heartbeat = Array('d', count, lock=False)	# time when the page in progress started
+
+	def begin_page(self, i, page_num, part=-1):
+		self.heartbeat[i] = time.time()
+		self.part[i] = part
+		self.current[i] = page_num
+
+	def begin_write(self, i):
+		# not to be killed for a timeout while it may hold the lock of the output queue
+		with self.lock:
+			self.current[i] = -1
+
+	def sent_pages(self, i, count):
+		self.sent[i] += count
+
+	def end_batch(self, i):
+		self.current[i] = -1
+		self.heartbeat[i] = time.time()
+		with self.condition:
+			self.sent[i] = 0
+			self.done[i] += 1
+			self.condition.notify()
+
+	def reset(self, i):
+		self.current[i] = -1
+		self.sent[i] = 0
+		self.done[i] = 0
+
+
+class ProcessThread(threading.Thread):
+	"""
+	A thread standing for a Process, for the threads executor: it has an
+	exitcode once it ends, but cannot be killed.
+	"""
+
+	def __init__(self, target, args):
+		super().__init__(target=target, args=args, daemon=True)
+		self.exitcode = None
+
+	def run(self):
+		try:
+			super().run()
+			self.exitcode = 0
+		except BaseException:
+			logging.exception("%s failed", self.name)
+			self.exitcode = 1
+
+
+class WorkerPool(object):
+	"""
+	The extract processes, each fed by its own queue, so that the jobs each
+	one holds are known.
+	A supervisor thread restarts the processes that die, or that spend more
+	than options.page_timeout on a page, and dispatches again the jobs they
+	held. A page that fails options.page_retries times is quarantined: it
+	gets an empty output, and is listed in the quarantine file.
+	With :param written:, the jobs of a process are held until the reduce
+	process writes their pages, so that the results still on their way when
+	the process dies are extracted again.
+	With :param scale:, the supervisor also starts or retires a process every
+	options.autoscale_period seconds, after the load, see autoscale().
+	With :param threads:, the extract processes are ProcessThreads, which
+	are restarted when they fail, but never for a timeout.
+	"""
+
+	supervise_period = 0.5		# seconds between checks
+
+	def __init__(self, count, output_queue, page_time, rings=None, quarantine_file=None, shards=None,
+				 stats=None, scale=None, threads=False, written=None):
+		"""
+		:param output_queue: where the results of the processes go, and of
+			the quarantined pages.
+		:param rings: input SharedRing and list of output SharedRing, as for
+			extract_process().
+		:param shards: (out_file, file_size, file_compress) for the processes
+			to write their results to shards of their own, see ShardWriter.
+		:param stats: PipelineStats with the Counters of the processes.
+		:param scale: (min, max) number of processes to scale the pool
+			within, starting from :param count:, or None for a fixed count.
+			There must be max output rings and Counters.
+		:param threads: whether to run threads rather than processes.
+		:param written: shared Value of the page the reduce process needs
+			next, all those before it being written, see FlowControl.
+		"""
+		slots = max(count, scale[1]) if scale else count
+		self.count = count					# processes taking jobs, in the first slots
+		self.output_queue = output_queue
+		self.page_time = page_time
+		self.rings = rings
+		self.quarantine_file = quarantine_file
+		self.shards = shards
+		self.stats = stats
+		self.scale = scale
+		self.threads = threads
+		self.written = written
+		self.shard_count = 0
+		self.launched = [False] * slots
+		self.status = WorkerStatus(slots)
+		self.lock = threading.Lock()		# between the mapper and the supervisor
+		self.processes = [None] * slots		# after count, processes retiring
+		self.queues = [None] * slots
+		self.assigned = [deque() for _ in range(slots)]	# batches not known to be done
+		self.unwritten = [deque() for _ in range(slots)]	# batches done, and not known to be written
+		self.completed = [0] * slots		# batches removed from assigned
+		self.failures = {}					# failures by job_key()
+		self.restarts = self.quarantined = 0
+		# load since the last scaling
+		self.scaled = default_timer()
+		self.put_wait = 0.0					# time the mapper waited for a process
+		self.idle = self.samples = 0		# processes without jobs, at each check
+		self.cpu = CpuUsage()
+		self.scalings = 0
+		self.closing = False
+		self.finished = threading.Event()
+		for i in range(count):
+			self.start(i)
+		self.supervisor = threading.Thread(target=self.supervise, daemon=True)
+		self.supervisor.start()
+
+	def start(self, i, restarted=False):
+		rings = None
+		if self.rings:
+			# the output ring position died with the process
+			rings = (self.rings[0], None if restarted else self.rings[1][i])
+		shard = None
+		if self.shards:
+			# a restarted process gets a new shard: the files of the stopped one are kept
+			out_file, file_size, file_compress = self.shards
+			shard = (out_file, '%02d' % self.shard_count, file_size, file_compress)
+			self.shard_count += 1
+		self.status.reset(i)
+		self.completed[i] = 0
+		self.unwritten[i] = deque()
+		self.queues[i] = ThreadQueue() if self.threads else Queue()
+		args = (options, i, self.queues[i], None if shard else self.output_queue,
+				self.page_time, rings, self.status, shard, self.stats and self.stats.workers[i], not self.threads)
+		if self.threads:
+			extractor = ProcessThread(extract_process, args)
+		else:
+			extractor = Process(target=extract_process, args=args)
+			extractor.daemon = True  # only live while parent process lives
+		extractor.start()
+		self.processes[i] = extractor
+		self.launched[i] = True
+
+	def outstanding(self, i):
+		"""Number of batches held by process :param i:."""
+		done = self.status.done[i] - self.completed[i]
+		for _ in range(done):
+			batch = self.assigned[i].popleft()
+			if self.written:
+				self.unwritten[i].append(batch)
+		self.completed[i] += done
+		if self.written:
+			unwritten = self.unwritten[i]
+			while unwritten and max(job[4] for job in unwritten[0]) < self.written.value:
+				unwritten.popleft()
+		return len(self.assigned[i])
+
+	def put(self, jobs):
+		"""Dispatch :param jobs: to the least loaded process, waiting if all have a batch queued."""
+		start = None
+		with self.status.condition:
+			while True:
+				with self.lock:
+					i = min(range(self.count), key=self.outstanding)
+					if self.outstanding(i) < 2:
+						self.assigned[i].append(jobs)
+						self.queues[i].put(jobs)
+						if start is not None:
+							self.put_wait += default_timer() - start
+						return
+				if start is None:
+					start = default_timer()
+				self.status.condition.wait(self.supervise_period)
+
+	def supervise(self):
+		while not self.finished.wait(self.supervise_period):
+			with self.lock:
+				for i, process in enumerate(self.processes):
+					if process is None:
+						continue
+					if i >= self.count and process.exitcode == 0 and not self.outstanding(i):
+						self.processes[i] = None		# retired
+					elif process.exitcode is None:
+						page_num = self.status.current[i]
+						if (page_num < 0 or not options.page_timeout or self.threads or
+							time.time() - self.status.heartbeat[i] < options.page_timeout):
+							continue
+						# it is not writing to the output queue while on a page, so
+						# it holds none of its locks
+						with self.status.lock:
+							if self.status.current[i] != page_num:
+								continue
+							process.kill()
+						process.join()
+						self.recover(i, 'timeout')
+					elif process.exitcode != 0 or self.outstanding(i):
+						self.recover(i, 'exit code %d' % process.exitcode)
+				if self.closing and all(process.exitcode == 0 for process in self.processes if process):
+					self.finished.set()
+				elif self.scale and not self.closing:
+					self.idle += sum(1 for i in range(self.count) if not self.outstanding(i))
+					self.samples += self.count
+					if default_timer() - self.scaled >= options.autoscale_period:
+						self.autoscale()
+
+	def autoscale(self):
+		"""
+		Start a process when the mapper waited for the processes most of the
+		time, while the output queue has room and the CPUs are not saturated.
+		Retire one when the processes were mostly idle, waiting for the
+		reader, or when the output queue is mostly full, waiting for the
+		writer, or when the CPUs are saturated.
+		"""
+		now = default_timer()
+		waited = self.put_wait / (now - self.scaled)
+		idle = self.idle / max(1, self.samples)
+		cpu = self.cpu.busy()
+		try:
+			queued = self.output_queue.qsize()
+		except (AttributeError, NotImplementedError):
+			queued = 0
+		capacity = getattr(self.output_queue, 'maxsize', 0)
+		backlog = queued / capacity if capacity > 0 else 0.0
+		self.scaled = now
+		self.put_wait = 0.0
+		self.idle = self.samples = 0
+		low, high = self.scale
+		count = self.count
+		if waited > 0.5 and backlog < 0.5 and cpu < 0.9 and count < high and self.processes[count] is None:
+			reason = 'the mapper waits for the extract processes'
+			self.start(count, restarted=self.launched[count])
+			self.count += 1
+		elif count > low and (idle > 0.5 or backlog > 0.75 or cpu > 0.95 and waited < 0.1):
+			if idle > 0.5:
+				reason = 'the extract processes wait for the reader'
+			elif backlog > 0.75:
+				reason = 'the extract processes wait for the writer'
+			else:
+				reason = 'the CPUs are saturated'
+			self.count -= 1
+			# it finishes the jobs it holds, then exits
+			self.queues[self.count].put(None)
+		else:
+			logging.debug("Keeping %d extract processes: mapper waited %.0f%%, %.0f%% idle, "
+						  "output queue %d/%d, CPU %.0f%%", count, 100 * waited, 100 * idle,
+						  queued, capacity, 100 * cpu)
+			return
+		self.scalings += 1
+		logging.info("Scaling from %d to %d extract processes, as %s: mapper waited %.0f%%, %.0f%% idle, "
+					 "output queue %d/%d, CPU %.0f%%", count, self.count, reason, 100 * waited, 100 * idle,
+					 queued, capacity, 100 * cpu)
+
+	def recover(self, i, reason):
+		"""Restart process :param i:, which stopped for :param reason:, dispatching its jobs again."""
+		page_num = self.status.current[i]
+		key = (page_num, self.status.part[i])
+		self.outstanding(i)
+		if self.written:
+			# the results put last may have died with the process
+			written = self.written.value
+			jobs = [job for batch in list(self.unwritten[i]) + list(self.assigned[i]) for job in batch
+					if job[4] >= written]
+		else:
+			batches = list(self.assigned[i])
+			if batches:
+				batches[0] = batches[0][self.status.sent[i]:]
+			jobs = [job for batch in batches for job in batch]
+		logging.warning("Extract process %d stopped (%s) on page %d, dispatching %d pages again",
+						i, reason, page_num, len(jobs))
+		if page_num >= 0:
+			self.failures[key] = self.failures.get(key, 0) + 1
+			if self.failures[key] >= options.page_retries:
+				for job in jobs:
+					if job_key(job) == key:
+						jobs.remove(job)
+						self.quarantine(job, reason)
+						break
+		self.assigned[i] = deque()
+		self.restarts += 1
+		if i >= self.count and not self.closing:
+			# a retiring process is not replaced, its jobs go to another one
+			self.processes[i] = None
+			i = min(range(self.count), key=self.outstanding)
+		else:
+			self.start(i, restarted=True)
+		if jobs:
+			self.assigned[i].append(jobs)
+			self.queues[i].put(jobs)
+		if self.closing:
+			self.queues[i].put(None)
+
+	def quarantine(self, job, reason):
+		"""Give up on :param job:, writing an empty output for it."""
+		id, revid, title, page, page_num, part = job
+		logging.error("Quarantined page %s %s after %d failures (%s)", id, title, self.failures[job_key(job)], reason)
+		self.quarantined += 1
+		if self.quarantine_file:
+			with open(self.quarantine_file, 'a', encoding='utf-8') as f:
+				f.write('%s\t%s\t%s\t%d\t%s\n' % (id, revid, title, page_num, reason))
+		input_end = page[0].end if page and isinstance(page[0], RingSlice) else None
+		text = (part[0], part[1], title, None) if part else ''
+		self.output_queue.put([(page_num, id, revid, text, input_end)])
+
+	def close(self):
+		"""Let the processes finish their jobs, and wait for them to exit."""
+		with self.lock:
+			self.closing = True
+			for process, queue in zip(self.processes, self.queues):
+				if process:
+					queue.put(None)
+		self.finished.wait()
+		self.supervisor.join()
+		if self.restarts:
+			logging.warning("Restarted extract processes %d times, quarantined %d pages",
+							self.restarts, self.quarantined)
+		if self.scale:
+			logging.info("Scaled the extract processes %d times, ending with %d", self.scalings, self.count)
+
+
+class InlinePool(object):
+	"""
+	Stands for a WorkerPool for the inline executor: each batch is extracted
+	by the mapper as it is dispatched, with the results going straight to
+	the output.
+	"""
+
+	def __init__(self, output_queue, page_time, shard=None, stats=None):
+		"""
+		:param output_queue: a ReorderWriter, or a ShardWriter.
+		:param shard: (out_file, file_size, file_compress) to write the
+			results to a shard of their own, see ShardWriter.
+		:param stats: PipelineStats with the Counters of the extraction.
+		"""
+		self.shard_count = 0
+		if shard:
+			out_file, file_size, file_compress = shard
+			output_queue = ShardWriter(out_file, '00', file_size, file_compress)
+			self.shard_count = 1
+		self.output_queue = output_queue
+		self.page_time = page_time
+		self.counters = stats and stats.workers[0]
+		self.jobs_queue = ThreadQueue()
+
+	def put(self, jobs):
+		# extract_process() returns at the None after the jobs
+		self.jobs_queue.put(jobs)
+		self.jobs_queue.put(None)
+		extract_process(options, 0, self.jobs_queue, self.output_queue, self.page_time,
+						counters=self.counters, setup_logger=False)
+
+	def close(self):
+		if self.shard_count:
+			self.output_queue.close()
+
+
+class RemoteWorkerPool(object):
+	"""
+	Extract processes on other machines, which connect to options.coordinator
+	(see run_remote_worker()), standing for a WorkerPool.
+	Each connection holds up to two batches. When it breaks, or when it stays
+	silent for options.page_timeout seconds while on a page, it is closed and
+	the pages it did not return are dispatched again to the other
+	connections; a page that was in progress options.page_retries times is
+	quarantined.
+	"""
+
+	poll_period = 0.05			# seconds between checks for batches to send
+
+	def __init__(self, output_queue, page_time, quarantine_file=None, stats=None):
+		"""
+		:param output_queue: where the results of the connections go, and of
+			the quarantined pages.
+		:param page_time: shared Value where to report the extraction time per
+			page, as reported by the workers.
+		:param stats: PipelineStats where to report the counters of the workers.
+		"""
+		self.output_queue = output_queue
+		self.page_time = page_time
+		self.quarantine_file = quarantine_file
+		self.stats = stats
+		self.shard_count = 0
+		self.condition = threading.Condition()
+		self.pending = deque()		# batches waiting for a connection
+		self.active = 0				# batches sent, and not all returned
+		self.connections = 0
+		self.threads = []
+		self.failures = {}			# failures by job_key()
+		self.restarts = self.quarantined = 0
+		self.closing = False
+		# the workers map their own copy of the template database
+		self.options = SimpleNamespace(**vars(options))
+		self.options.templateCache = {}
+		if isinstance(options.templates, TemplateDB):
+			self.options.templates = self.options.redirects = None
+		check_authkey(options.coordinator, options.authkey)
+		self.listener = Listener(options.coordinator, authkey=options.authkey)
+		logging.info("Waiting for extract processes on %s:%d", *self.listener.address)
+		self.acceptor = threading.Thread(target=self.accept, daemon=True)
+		self.acceptor.start()
+
+	def accept(self):
+		while True:
+			try:
+				conn = self.listener.accept()
+			except (OSError, EOFError, AuthenticationError) as e:
+				if self.closing:
+					return
+				logging.warning("Refused connection: %s", e)
+				continue
+			if self.closing:
+				conn.close()
+				return
+			thread = threading.Thread(target=self.serve, args=(conn, len(self.threads)), daemon=True)
+			self.threads.append(thread)
+			thread.start()
+
+	def send_options(self, conn):
+		conn.send(self.options)
+		if isinstance(options.templates, TemplateDB):
+			with open(options.templates.path, 'rb') as f:
+				for chunk in iter(partial(f.read, 1 << 24), b''):
+					conn.send_bytes(chunk)
+		conn.send_bytes(b'')
+
+	def serve(self, conn, n):
+		"""Send batches to connection :param n:, and collect their results, until it breaks or the pool closes."""
+		sent = deque()			# batches sent
+		received = 0			# results of the first batch received
+		heard = time.time()		# when the page in progress started, or the connection got a batch
+		current = None			# job_key() of the page in progress
+		connected = False
+		try:
+			self.send_options(conn)
+			with self.condition:
+				self.connections += 1
+				connected = True
+			logging.info("Extract process %d connected", n)
+			while True:
+				batches = []
+				with self.condition:
+					while len(sent) + len(batches) < 2 and self.pending:
+						batches.append(self.pending.popleft())
+					sent.extend(batches)
+					self.active += len(batches)
+					if batches:
+						self.condition.notify_all()		# room for the mapper
+					elif not sent and self.closing:
+						break
+				if batches and len(sent) == len(batches):
+					heard = time.time()
+				for jobs in batches:
+					conn.send(jobs)
+				if not conn.poll(self.poll_period):
+					if sent and options.page_timeout and time.time() - heard > options.page_timeout:
+						raise TimeoutError('timeout')
+					continue
+				message = conn.recv()
+				heard = time.time()
+				if isinstance(message, tuple):
+					if message[0] == 'page':
+						# the worker begins a page
+						current = message[1:]
+						continue
+					current = None
+					# time per page of the last batch, and counters of the worker
+					_, message, counters = message
+					page_time = self.page_time.value
+					self.page_time.value = message if page_time == 0 else 0.8 * page_time + 0.2 * message
+					if self.stats:
+						self.stats.remote[n] = counters
+					continue
+				self.output_queue.put(message)
+				received += len(message)
+				with self.condition:
+					while sent and received >= len(sent[0]):
+						received -= len(sent.popleft())
+						self.active -= 1
+						self.condition.notify_all()
+			conn.send(None)
+		except (OSError, EOFError) as e:
+			if sent:
+				self.recover(n, sent, received, e, current)
+			else:
+				logging.info("Extract process %d disconnected", n)
+		finally:
+			conn.close()
+			if connected:
+				with self.condition:
+					self.connections -= 1
+
+	def recover(self, n, sent, received, reason, current=None):
+		"""
+		Dispatch again the jobs in :param sent: of connection :param n:, but
+		the first :param received:.
+		:param current: job_key() of the page in progress, if any.
+		"""
+		jobs = [job for batch in sent for job in batch][received:]
+		if not isinstance(reason, TimeoutError):
+			reason = 'disconnected: %s' % (str(reason) or type(reason).__name__)
+		reason = str(reason)
+		logging.warning("Extract process %d %s, dispatching %d pages again", n, reason, len(jobs))
+		with self.condition:
+			self.active -= len(sent)
+			self.restarts += 1
+			if current:
+				self.failures[current] = self.failures.get(current, 0) + 1
+				if self.failures[current] >= options.page_retries:
+					for job in jobs:
+						if job_key(job) == current:
+							jobs.remove(job)
+							self.quarantine(job, reason)
+							break
+			if jobs:
+				self.pending.appendleft(jobs)
+			self.condition.notify_all()
+
+	quarantine = WorkerPool.quarantine
+
+	def put(self, jobs):
+		"""Queue :param jobs: for the first connection with room, waiting while enough are queued."""
+		# the workers cannot read the dump mapped here
+		jobs = [(id, revid, title, decode_page(page), page_num, part)
+				for id, revid, title, page, page_num, part in jobs]
+		with self.condition:
+			while len(self.pending) >= max(2, self.connections):
+				self.condition.wait()
+			self.pending.append(jobs)
+
+	def close(self):
+		"""Wait for the connections to return all the jobs, then let the workers quit."""
+		with self.condition:
+			while self.pending or self.active:
+				self.condition.wait()
+			self.closing = True
+		try:
+			# wake up the acceptor
+			Client(self.listener.address, authkey=options.authkey).close()
+		except (OSError, EOFError, AuthenticationError):
+			pass
+		self.acceptor.join()
+		self.listener.close()
+		for thread in self.threads:
+			thread.join()
+		if self.restarts:
+			logging.warning("Extract processes disconnected %d times, quarantined %d pages",
+							self.restarts, self.quarantined)
+
+
+def extract_process(opts, i, jobs_queue, output_queue, page_time=None, rings=None, status=None,
+					shard=None, counters=None, setup_logger=True):
+	"""Pull lists of tuples of raw page content, do CPU/regex-heavy fixup, push
+	lists of (page_num, id, revid, text, input_end) with the finished text
 	:param i: process id.
 	:param jobs_queue: where to get jobs.
 	:param output_queue: where to queue extracted text for output.
+	:param page_time: shared Value where to report the extraction time per page.
+	:param rings: the input SharedRing and the output SharedRing of this
+		process, when the text travels in shared memory. The text then comes
+		back as a RingSlice, or as bytes when the output ring is full or is
+		None, and input_end tells where the input ring can be released.
+	:param status: WorkerStatus where to report progress.
+	:param shard: arguments of the ShardWriter where to write the results
+		instead of :param output_queue:.
+	:param counters: Counters of this process in a PipelineStats.
+	:param setup_logger: whether to set up the logger, in a process of its
+		own rather than a thread of the main one.
 	"""
 
 	global options
 	options = opts
 
-	createLogger(options.quiet, options.debug, options.log_file)
+	if setup_logger:
+		createLogger(options.quiet, options.debug, options.log_file)
+
+	if shard:
+		output_queue = ShardWriter(*shard)
 
 	out = StringIO()				 # memory buffer
 
 
 	while True:
-		job = jobs_queue.get()	# job is (id, title, page, page_num)
-		if job:
-			id, revid, title, page, page_num = job
-			try:
-				e = Extractor(*job[:4]) # (id, revid, title, page)
-				page = None				 # free memory
-				e.extract(out)
-				text = out.getvalue()
-			except:
-				text = ''
-				logging.exception('Processing page: %s %s', id, title)
-
-			output_queue.put((page_num, text))
-			out.truncate(0)
-			out.seek(0)
+		jobs = jobs_queue.get()	# jobs is a list of (id, revid, title, page, page_num, part)
+		if jobs:
+			start = default_timer()
+			results = []
+			size = 0
+			for id, revid, title, page, page_num, part in jobs:
+				if status:
+					status.begin_page(i, page_num, part[0] if part else -1)
+				input_end = None
+				try:
+					if page and isinstance(page[0], RingSlice):
+						input_end = page[0].end
+						with rings[0].view(page[0]) as view:
+							page = [str(view, 'utf-8')]
+					e = Extractor(id, revid, title, decode_page(page))
+					page = None				 # free memory
+					if part:
+						# the reduce process merges the data of the parts
+						text = (part[0], part[1], title, e.extract_data())
+					else:
+						e.extract(out)
+						text = out.getvalue()
+					if counters:
+						count_template_errors(counters, e)
+				except:
+					text = (part[0], part[1], title, None) if part else ''
+					logging.exception('Processing page: %s %s', id, title)
+
+				if rings and rings[1]:
+					data = text.encode('utf-8')
+					# never wait for room: the reduce process may need a page
+					# that no process has picked yet
+					text = rings[1].write(data, i) or data
+				results.append((page_num, id, revid, text, input_end))
+				size += len(text)
+				if size >= options.batch_bytes:
+					if status:
+						status.begin_write(i)
+					output_queue.put(results)
+					if status:
+						status.sent_pages(i, len(results))
+					results = []
+					size = 0
+				out.truncate(0)
+				out.seek(0)
+			if results:
+				if status:
+					status.begin_write(i)
+				output_queue.put(results)
+			if isinstance(options.templateCache, TemplateCache):
+				options.templateCache.flush_stats()
+			if status:
+				status.end_batch(i)
+			elapsed = default_timer() - start
+			if counters:
+				counters.add('extracted_pages', len(jobs))
+				counters.add('busy_seconds', elapsed)
+			if page_time is not None:
+				# moving average, updated without lock: a lost update is harmless
+				elapsed /= len(jobs)
+				page_time.value = elapsed if page_time.value == 0 else 0.8 * page_time.value + 0.2 * elapsed
 		else:
 			logging.debug('Quit extractor')
 			break
 	out.close()
+	if shard:
+		output_queue.close()
+
+
+class ConnectionQueue(object):
+	"""
+	The connection of a remote extract process to the coordinator, standing
+	for its jobs queue, its output queue and its WorkerStatus. The
+	coordinator times out the process when it hears nothing from it for
+	options.page_timeout seconds, and it tells when it begins each page.
+	"""
+
+	def __init__(self, conn):
+		self.conn = conn
+		self.page_time = Value('d', 0.0, lock=False)
+		self.counters = Counters(PipelineStats.worker_counters)
+		self.batches = 0
+
+	def get(self):
+		if self.batches:
+			# the previous batch is done
+			self.conn.send(('stats', self.page_time.value, list(self.counters.values)))
+		self.batches += 1
+		return self.conn.recv()
+
+	def put(self, results):
+		self.conn.send(results)
+
+	def begin_page(self, i, page_num, part=-1):
+		self.conn.send(('page', page_num, part))
+
+	def begin_write(self, i):
+		pass
+
+	def sent_pages(self, i, count):
+		pass
+
+	def end_batch(self, i):
+		pass
+
+
+def run_remote_worker(address, authkey, i=0, timeout=60):
+	"""
+	Extract process working for the coordinator at :param address:, see
+	RemoteWorkerPool. It gets the options and the templates from the coordinator.
+	:param i: process id.
+	:param timeout: seconds to keep trying to connect.
+	"""
+	check_authkey(address, authkey)
+	deadline = time.time() + timeout
+	while True:
+		try:
+			conn = Client(address, authkey=authkey)
+			break
+		except ConnectionRefusedError:
+			if time.time() > deadline:
+				raise
+			time.sleep(1)
+	template_db = None
+	with conn:
+		opts = conn.recv()
+		chunk = conn.recv_bytes()
+		if chunk:
+			fd, template_db = tempfile.mkstemp(suffix='.tpldb')
+			with os.fdopen(fd, 'wb') as f:
+				while chunk:
+					f.write(chunk)
+					chunk = conn.recv_bytes()
+			opts.templates = TemplateDB(template_db)
+			opts.redirects = opts.templates.redirects
+		if opts.expand_templates:
+			opts.templateCache = TemplateCache(opts.template_cache_size)
+		queue = ConnectionQueue(conn)
+		try:
+			extract_process(opts, i, queue, queue, queue.page_time, status=queue, counters=queue.counters)
+		finally:
+			if template_db:
+				opts.templates.close()
+				os.remove(template_db)
+
+
+def check_authkey(address, authkey):
+	"""
+	Refuse the default :param authkey: for connections to or from other
+	machines at :param address:: the coordinator and the workers unpickle
+	what they receive, so anyone with the key can run code on them.
+	"""
+	if authkey != default_authkey:
+		return
+	host = address[0]
+	try:
+		loopback = all(ipaddress.ip_address(info[4][0]).is_loopback
+					   for info in socket.getaddrinfo(host, None))
+	except (OSError, ValueError):
+		loopback = False
+	if not loopback:
+		raise ValueError("connections with other machines at %s require an --authkey of your own, "
+						 "the default one is public" % host)
+
+
+def parse_address(address):
+	""":return: the (host, port) of :param address: HOST:PORT."""
+	host, _, port = address.rpartition(':')
+	return (host or 'localhost', int(port))
 
 
 report_period = 10000			# progress report period
-def reduce_process(opts, output_queue, spool_length,
-				   out_file=None, file_size=0, file_compress=True):
+class ReorderWriter(object):
+	"""
+	Writes the results of the extract processes in page order, to a series of
+	files or to stdout. It runs in reduce_process(), or stands for the output
+	queue of the inline executor.
+	"""
+
+	def __init__(self, flow, out_file=None, file_size=0, file_compress=True, rings=None, counters=None,
+				 positions=None, resume=None):
+		"""
+		:param flow: FlowControl of the mapper.
+		:param out_file: filename where to print.
+		:param file_size: max file size.
+		:param file_compress: whether to compress output.
+		:param rings: the input SharedRing and the list of output SharedRing of
+			the extract processes, when the text travels in shared memory.
+		:param counters: writer Counters of a PipelineStats.
+		:param positions: DumpPositions of the mapper, to write a checkpoint in
+			:param out_file: every options.checkpoint_period seconds.
+		:param resume: state of the checkpoint from which to resume the output.
+		"""
+		self.flow = flow
+		self.out_file = out_file
+		self.rings = rings
+		self.counters = counters
+		self.positions = positions
+		self.manifest = None
+		if out_file:
+			nextFile = NextFile(out_file)
+			manifest_path = os.path.join(out_file, manifest_name)
+			if resume:
+				nextFile.dir_index, nextFile.file_index = resume['file_index']
+				self.output = OutputSplitter(nextFile, file_size, file_compress,
+											 (resume['file_size'], resume['file_offset']))
+				with open(manifest_path, 'r+b') as f:
+					f.truncate(resume['manifest_size'])
+				self.manifest = open(manifest_path, 'a', encoding='utf-8')
+			else:
+				self.output = OutputSplitter(nextFile, file_size, file_compress)
+				self.manifest = open(manifest_path, 'w', encoding='utf-8')
+		else:
+			self.output = sys.stdout.buffer
+			if file_compress:
+				logging.warn("writing to stdout, so no output compression (use an external tool)")
+
+		self.interval_start = default_timer()
+		# reorder buffer: heap of the pages that arrived before next_page
+		self.heap = []
+		self.buffered = 0	  # size of the pages in heap
+		self.peak_pages = self.peak_buffered = 0
+		self.next_page = resume['next_page'] if resume else 0	  # sequence numbering of page
+		self.last_id = None
+		self.checkpoint_time = default_timer()
+		# head-of-line blocking: time spent with pages in heap waiting for next_page
+		self.blocked_since = None
+		self.blocked_time = self.longest_block = 0.0
+		self.split = {}		# data of the parts of split pages, by page_num
+
+	def put(self, results):
+		"""Write the pages of :param results: that are next in order, buffering the others."""
+		heap = self.heap
+		split = self.split
+		output = self.output
+		for page_num, id, revid, text, input_end in results:
+			if page_num < self.next_page:
+				continue		# sent again by a restarted extract process
+			if isinstance(text, tuple):
+				part, count, title, data = text
+				parts = split.setdefault(page_num, {})
+				parts[part] = data
+				if len(parts) < count:
+					continue
+				text = merge_language_parts(id, revid, title, [parts[i] for i in range(count)])
+			data = text if isinstance(text, (bytes, RingSlice)) else text.encode('utf-8')
+			heapq.heappush(heap, (page_num, id, revid, data, input_end))
+			self.buffered += len(data)
+		written = 0
+		while heap and heap[0][0] <= self.next_page:
+			page_num, id, revid, data, input_end = heapq.heappop(heap)
+			self.buffered -= len(data)
+			if page_num < self.next_page:
+				continue		# duplicate
+			split.pop(page_num, None)
+			if isinstance(data, RingSlice):
+				# written straight from shared memory, then released
+				ring = self.rings[1][data.ring]
+				with ring.view(data) as view:
+					offset = output.write(view)
+				ring.release(data.end)
+			else:
+				offset = output.write(data)
+			if input_end is not None:
+				self.rings[0].release(input_end)
+			if self.manifest:
+				self.manifest.write('%s\t%s\t%s\t%d\t%d\n' % (id, revid, os.path.relpath(output.filename, self.out_file),
+																offset, len(data)))
+			self.next_page += 1
+			written += 1
+			self.last_id = id
+			if self.counters:
+				self.counters.add('written_pages')
+				self.counters.add('written_bytes', len(data))
+			# progress report
+			if self.next_page % report_period == 0:
+				interval_rate = report_period / (default_timer() - self.interval_start)
+				logging.info("Extracted %d articles (%.1f art/s)",
+							 self.next_page, interval_rate)
+				self.interval_start = default_timer()
+		if written and self.blocked_since is not None:
+			block = default_timer() - self.blocked_since
+			self.blocked_time += block
+			self.longest_block = max(self.longest_block, block)
+			self.blocked_since = None
+		if heap and self.blocked_since is None:
+			self.blocked_since = default_timer()
+		self.peak_pages = max(self.peak_pages, len(heap))
+		self.peak_buffered = max(self.peak_buffered, self.buffered)
+		# tell mapper our load:
+		self.flow.update(written, self.buffered, self.next_page)
+		if (self.positions and self.manifest and self.last_id is not None and
+				default_timer() - self.checkpoint_time >= options.checkpoint_period):
+			write_checkpoint(self.out_file, output, self.manifest,
+							 {'next_page': self.next_page, 'last_id': self.last_id,
+							  'position': self.positions.find(self.next_page)})
+			self.checkpoint_time = default_timer()
+
+	def close(self):
+		if self.heap:
+			logging.error("%d pages were not written, missing page %d", len(self.heap), self.next_page)
+		logging.info("Reorder buffer peak %d pages (%.1f MB), head-of-line blocked for %.1fs, longest %.1fs",
+					 self.peak_pages, self.peak_buffered / 1024**2, self.blocked_time, self.longest_block)
+		if self.out_file:
+			self.output.close()
+		else:
+			# stdout stays open, it may be that of the mapper
+			self.output.flush()
+		if self.manifest:
+			self.manifest.close()
+
+
+def reduce_process(opts, output_queue, flow,
+				   out_file=None, file_size=0, file_compress=True, rings=None, counters=None,
+				   positions=None, resume=None, setup_logger=True):
 	"""Pull finished article text, write series of files (or stdout)
 	:param opts: global parameters.
 	:param output_queue: text to be output.
-	:param spool_length: spool length.
-	:param out_file: filename where to print.
-	:param file_size: max file size.
-	:param file_compress: whether to compress output.
+	:param setup_logger: as for extract_process().
+	The other parameters are those of ReorderWriter.
 	"""
 
 	global options
 	options = opts
 
-	createLogger(options.quiet, options.debug, options.log_file)
+	if setup_logger:
+		createLogger(options.quiet, options.debug, options.log_file)
 
-	if out_file:
-		nextFile = NextFile(out_file)
-		output = OutputSplitter(nextFile, file_size, file_compress)
-	else:
-		output = sys.stdout.buffer
-		if file_compress:
-			logging.warn("writing to stdout, so no output compression (use an external tool)")
-
-	interval_start = default_timer()
-	# FIXME: use a heap
-	spool = {}		  # collected pages
-	next_page = 0	  # sequence numbering of page
+	writer = ReorderWriter(flow, out_file, file_size, file_compress, rings, counters, positions, resume)
 	while True:
-		if next_page in spool:
-			output.write(spool.pop(next_page).encode('utf-8'))
-			next_page += 1
-			# tell mapper our load:
-			spool_length.value = len(spool)
-			# progress report
-			if next_page % report_period == 0:
-				interval_rate = report_period / (default_timer() - interval_start)
-				logging.info("Extracted %d articles (%.1f art/s)",
-							 next_page, interval_rate)
-				interval_start = default_timer()
-		else:
-			# mapper puts None to signal finish
-			pair = output_queue.get()
-			if not pair:
-				break
-			page_num, text = pair
-			spool[page_num] = text
-			# tell mapper our load:
-			spool_length.value = len(spool)
-			# FIXME: if an extractor dies, process stalls; the other processes
-			# continue to produce pairs, filling up memory.
-			if len(spool) > 200:
-				logging.debug('Collected %d, waiting: %d, %d', len(spool),
-							  next_page, next_page == page_num)
-	if output != sys.stdout:
-		output.close()
+		# mapper puts None to signal finish
+		results = output_queue.get()
+		if results is None:
+			break
+		writer.put(results)
+	writer.close()
 
 
 # ----------------------------------------------------------------------
@@ -3292,8 +6553,16 @@ def main():
 	parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]),
 									 formatter_class=argparse.RawDescriptionHelpFormatter,
 									 description=__doc__)
-	parser.add_argument("input",
-						help="XML wiki dump file")
+	parser.add_argument("input", nargs='*',
+						help="XML wiki dump file, or the files or glob patterns of the parts of a dump")
+	parser.add_argument("--multistream_index", metavar="INDEX",
+						help="index file of a multistream bz2 dump, to decompress its streams in parallel")
+	parser.add_argument("--incremental", metavar="PREVIOUS_MANIFEST",
+						help="copy the previous output listed in PREVIOUS_MANIFEST for the pages whose "
+							 "revision did not change, extracting only changed and new pages")
+	parser.add_argument("--titles", metavar="FILE",
+						help="extract only the pages whose titles are listed in FILE, one per line, "
+							 "reading just their streams (requires --multistream_index)")
 	groupO = parser.add_argument_group('Output')
 	groupO.add_argument("-o", "--output", default="text",
 						help="directory for extracted files (or '-' for dumping to stdout)")
@@ -3304,6 +6573,9 @@ def main():
 						help="compress output files using bzip")
 	groupO.add_argument("--json", action="store_true",
 						help="write output in json format instead of the default one")
+	groupO.add_argument("--unordered", action="store_true",
+						help="each extract process writes its own shard directory, in no particular "
+							 "order; the manifest lists the pages in dump order")
 
 
 	groupP = parser.add_argument_group('Processing')
@@ -3319,6 +6591,12 @@ def main():
 						help="accepted namespaces in links")
 	groupP.add_argument("--templates",
 						help="use or create file containing templates")
+	groupP.add_argument("--template_db",
+						help="use or create a pre-parsed, memory-mapped template database; "
+							 "when it exists --templates is not read")
+	groupP.add_argument("--spool_dir",
+						help="directory for the articles set aside while creating the --templates file "
+							 "(default the system temporary directory)")
 	groupP.add_argument("--no_templates", action="store_false",
 						help="Do not expand templates")
 	groupP.add_argument("-r", "--revision", action="store_true", default=options.print_revision,
@@ -3336,6 +6614,63 @@ def main():
 	default_process_count = max(1, cpu_count() - 1)
 	parser.add_argument("--processes", type=int, default=default_process_count,
 						help="Number of processes to use (default %(default)s)")
+	parser.add_argument("--executor", choices=['processes', 'threads', 'inline'], default=options.executor,
+						help="Extract in --processes processes, in --processes threads of this process, "
+							 "or inline, one page after the other (default %(default)s)")
+	parser.add_argument("--autoscale", metavar="MIN:MAX",
+						help="Start and retire extract processes after the load, keeping between MIN "
+							 "and MAX, from --processes")
+	parser.add_argument("--reorder_memory", type=int, default=options.reorder_memory, metavar="MB",
+						help="Maximum size of the extracted pages waiting to be written in order "
+							 "(default %(default)s MB)")
+	parser.add_argument("--batch_pages", type=int, default=options.batch_pages,
+						help="Maximum number of pages sent at once to an extract process, "
+							 "adapted to their extraction time (default %(default)s)")
+	parser.add_argument("--split_languages", type=int, default=options.split_languages, metavar="KB",
+						help="Split the pages of at least KB kilobytes at their language sections, "
+							 "extracted in parallel, 0 for no split (default %(default)s)")
+	parser.add_argument("--lookahead", type=int, default=options.lookahead, metavar="PAGES",
+						help="Dispatch early the pages expected to take long to extract, up to "
+							 "PAGES ahead, 0 to dispatch all in order (default %(default)s)")
+	parser.add_argument("--shared_memory", type=int, default=options.shared_memory, metavar="MB",
+						help="Send the text of the pages to and from the extract processes through "
+							 "shared memory rings of MB megabytes, rather than the queues")
+	parser.add_argument("--template_cache", type=int, default=options.template_cache, metavar="MB",
+						help="Share the parsed templates among the extract processes in MB megabytes "
+							 "of shared memory, 0 for none (default %(default)s)")
+	parser.add_argument("--page_timeout", type=int, default=options.page_timeout, metavar="SECONDS",
+						help="Restart an extract process that spends more than SECONDS on a page, "
+							 "0 for no limit (default %(default)s)")
+	parser.add_argument("--page_retries", type=int, default=options.page_retries, metavar="N",
+						help="Quarantine a page after N failures of the extract processes on it, "
+							 "rather than dispatching it again (default %(default)s)")
+	parser.add_argument("--quarantine", metavar="FILE",
+						help="File listing the pages that failed repeatedly and were skipped "
+							 "(default quarantine.tsv in the output directory)")
+	parser.add_argument("--decompress_processes", type=int, default=options.decompress_processes,
+						help="Number of processes decompressing a multistream dump, or reading dump parts "
+							 "(default a quarter of --processes)")
+	parser.add_argument("--coordinator", metavar="HOST:PORT",
+						help="Listen on HOST:PORT for the extract processes of other machines, started "
+							 "with --worker, instead of running extract processes here")
+	parser.add_argument("--worker", metavar="HOST:PORT",
+						help="Run --processes extract processes for the coordinator at HOST:PORT, "
+							 "which sends them the pages and the options")
+	parser.add_argument("--authkey", default=options.authkey.decode(),
+						help="Key authenticating the coordinator and its workers to each other, "
+							 "required unless they connect through the loopback interface")
+	parser.add_argument("--checkpoint", type=int, default=options.checkpoint_period, metavar="SECONDS",
+						help="Make the output durable every SECONDS, recording where to --resume, "
+							 "0 for never (default %(default)s)")
+	parser.add_argument("--resume", action="store_true",
+						help="Resume the output from its last checkpoint, after an interrupted run "
+							 "with the same arguments")
+	parser.add_argument("--stats_file", metavar="FILE",
+						help="Write the statistics of the stages of the extraction to FILE as JSON, "
+							 "every %d seconds" % options.stats_period)
+	parser.add_argument("--stats_port", type=int, default=options.stats_port, metavar="PORT",
+						help="Serve the statistics of the extraction on PORT of localhost, in the "
+							 "Prometheus text format, 0 for none (default %(default)s)")
 
 	groupS = parser.add_argument_group('Special')
 	groupS.add_argument("-q", "--quiet", action="store_true",
@@ -3346,6 +6681,11 @@ def main():
 						help="analyze a file containing a single article (debug option)")
 	groupS.add_argument("--log_file",
 						help="path to save the log info")
+	groupS.add_argument("--build_index", metavar="INDEX_FILE",
+						help="write an index of the dump for random access to its pages, then exit")
+	groupS.add_argument("--metadata", action="store_true",
+						help="print id, revision id, title, namespace and text size of each page, "
+							 "tab separated, without extracting text")
 	groupS.add_argument("-v", "--version", action="version",
 						version='%(prog)s ' + version,
 						help="print program version")
@@ -3359,6 +6699,7 @@ def main():
 	options.keepLists = args.lists
 	options.toHTML = args.html
 	options.write_json = args.json
+	options.unordered = args.unordered
 	options.print_revision = args.revision
 	options.min_text_length = args.min_text_length
 	if args.html:
@@ -3367,6 +6708,32 @@ def main():
 	options.expand_templates = args.no_templates
 	options.filter_disambig_pages = args.filter_disambig_pages
 	options.keep_tables = args.keep_tables
+	options.decompress_processes = args.decompress_processes
+	options.spool_dir = args.spool_dir
+	options.template_db = args.template_db
+	options.reorder_memory = args.reorder_memory
+	options.batch_pages = args.batch_pages
+	options.lookahead = args.lookahead
+	options.split_languages = args.split_languages
+	options.shared_memory = args.shared_memory
+	options.template_cache = args.template_cache
+	options.page_timeout = args.page_timeout
+	options.page_retries = max(1, args.page_retries)
+	options.quarantine_file = args.quarantine
+	options.authkey = args.authkey.encode()
+	options.stats_file = args.stats_file
+	options.checkpoint_period = args.checkpoint
+	options.resume = args.resume
+	options.stats_port = args.stats_port
+	options.executor = args.executor
+	if args.autoscale:
+		low, _, high = args.autoscale.partition(':')
+		try:
+			options.autoscale = (max(1, int(low)), max(1, int(low), int(high or low)))
+		except ValueError:
+			parser.error("--autoscale takes MIN:MAX numbers of processes")
+	if args.coordinator:
+		options.coordinator = parse_address(args.coordinator)
 
 	try:
 		power = 'kmg'.find(args.bytes[-1].lower()) + 1
@@ -3406,26 +6773,64 @@ def main():
 	options.log_file = args.log_file
 	createLogger(options.quiet, options.debug, options.log_file)
 
-	input_file = args.input
+	if args.worker:
+		address = parse_address(args.worker)
+		try:
+			check_authkey(address, options.authkey)
+		except ValueError as e:
+			parser.error(str(e))
+		workers = [Process(target=run_remote_worker, args=(address, options.authkey, i))
+				   for i in range(args.processes)]
+		for worker in workers:
+			worker.start()
+		for worker in workers:
+			worker.join()
+		return
+	if not args.input:
+		parser.error("the input file is required")
+	if options.coordinator:
+		try:
+			check_authkey(options.coordinator, options.authkey)
+		except ValueError as e:
+			parser.error(str(e))
+
+	try:
+		input_files = dump_parts(args.input)
+	except ValueError as e:
+		logging.error(str(e))
+		return
+	input_file = input_files[0] if len(input_files) == 1 else input_files
 
 	if not options.keepLinks:
 		ignoreTag('a')
 
-	# sharing cache of parser templates is too slow:
-	# manager = Manager()
-	# templateCache = manager.dict()
+	if len(input_files) > 1 and (args.build_index or args.article or args.multistream_index):
+		logging.error('--build_index, --article and --multistream_index require a single input file')
+		return
+
+	if args.build_index:
+		DumpIndex.build(input_file, args.build_index, args.multistream_index, args.processes)
+		return
+
+	if args.metadata:
+		for part in input_files:
+			with open_dump(part) as file:
+				for page_data in page_metadata(file):
+					print(*page_data, sep='\t')
+		return
 
 	if args.article:
-		if args.templates:
+		if args.template_db and os.path.exists(args.template_db):
+			use_template_db(args.template_db)
+		elif args.templates:
 			if os.path.exists(args.templates):
 				with open(args.templates) as file:
 					load_templates(file)
 
-		file = fileinput.FileInput(input_file, openhook=fileinput.hook_compressed)
-		for page_data in pages_from(file):
-			id, revid, title, ns,catSet, page = page_data
-			Extractor(id, revid, title, page).extract(sys.stdout)
-		file.close()
+		with open_dump(input_file) as file:
+			for page_data in pages_from_bytes(file):
+				id, revid, title, ns,catSet, page = page_data
+				Extractor(id, revid, title, page).extract(sys.stdout)
 		return
 
 	output_path = args.output
@@ -3436,6 +6841,14 @@ def main():
 			logging.error('Could not create: %s', output_path)
 			return
 
+	titles = None
+	if args.titles:
+		if not args.multistream_index:
+			logging.error('--titles requires --multistream_index')
+			return
+		with open(args.titles, encoding='utf-8') as f:
+			titles = set(line.strip() for line in f if line.strip())
+
 	filter_category = args.filter_category
 	if (filter_category != None and len(filter_category)>0):
 		with open(filter_category) as f:
@@ -3459,9 +6872,9 @@ def main():
 			logging.info(str(len(options.filter_category_include)))
 
 	process_dump(input_file, args.templates, output_path, file_size,
-				 args.compress, args.processes)
+				 args.compress, args.processes, args.multistream_index, titles, args.incremental)
 
-def manual_main(input_file, output_path, processes=1):
+def manual_main(input_file, output_path, processes=1, executor='processes'):
 
 	class args: pass
 	args.bytes = '1M'
@@ -3501,6 +6914,7 @@ def manual_main(input_file, output_path, processes=1):
 	options.toHTML=False
 	options.urlbase=''
 	options.write_json=True
+	options.executor=executor
 
 	process_dump(input_file, False, output_path, file_size, False, processes)
 
@@ -1,8 +1,8 @@
 import fileinput
 from unidecode import unidecode
 from dgnutils import *
-from wikiextractor.WikiExtractor import findMatchingBraces, splitParts, options, replaceInternalLinks, dropNested, Extractor, compact, pages_from, keepPage
-from io import StringIO
+from wikiextractor.WikiExtractor import findMatchingBraces, splitParts, options, replaceInternalLinks, dropNested, Extractor, compact, pages_from, pages_from_bytes, keepPage, DumpIndex
+from io import StringIO, BytesIO
 
 options.write_json = True
 options.expand_templates = False
@@ -2044,20 +2044,42 @@ def get_tree_connections(tree):
 	return connections
 	
 
+dump_indexes = {} # open DumpIndex by dump path
+
+def get_dump_index(wiki_dump_path):
+	"""
+	Get the title index of a wiki dump, for random access to its pages
+	The index is stored next to the dump (e.g. "input/test.xml.index") and built
+	with a single pass over the dump the first time, or when the dump changed
+	For "...-multistream.xml.bz2" dumps, the "...-multistream-index.txt.bz2" next to it is used
+	"""
+	dump_index = dump_indexes.get(wiki_dump_path)
+	if dump_index and dump_index.is_current(): return dump_index
+	index_file = wiki_dump_path + '.index'
+	if os.path.exists(index_file):
+		dump_index = DumpIndex(index_file, wiki_dump_path)
+	if not dump_index or not dump_index.is_current():
+		if dump_index: dump_index.close()
+		logging.info(f'Indexing {wiki_dump_path} (only needed once)...')
+		multistream_index = wiki_dump_path[:-len('.xml.bz2')] + '-index.txt.bz2' if wiki_dump_path.endswith('.xml.bz2') else None
+		if multistream_index and not os.path.exists(multistream_index):
+			raise FileNotFoundError(f'{wiki_dump_path} can only be indexed as a multistream dump, but its index {multistream_index} was not found; '
+									'use a "-multistream.xml.bz2" dump with its index, or the decompressed dump')
+		dump_index = DumpIndex.build(wiki_dump_path, index_file, multistream_index=multistream_index, process_count=os.cpu_count())
+	dump_indexes[wiki_dump_path] = dump_index
+	return dump_index
+
 def get_wikidump_text(word, filepath='/Users/nish/development/git/wikiextractor/input/enwiktionary-latest-pages-articles.xml'):
 	"""
 	:param word - the word to search for
 	:param filname (optional) - the filepath to search in
 	Get the text of a particular word from the enwiktionary-latest-pages-articles.xml
-	Uses pages_from of WikiExtractor
+	Seeks to the page through the dump index (see get_dump_index)
 	"""
-	with open(filepath, 'r') as f:
-		for i, page_data in enumerate(pages_from(f)):
-			if i and not i % 100000: print(f'\rEvaluated {i} pages', end='')
-			id, revid, title, ns, catSet, page = page_data
-			if title == word:
-				return ''.join(page)
-				break
+	page = get_dump_index(filepath).read_page(word, redirects=False)
+	if page:
+		for id, revid, title, ns, catSet, page in pages_from_bytes(BytesIO(page)):
+			return ''.join(page)
 	logging.error(f'Could not find word: {word}')
 	return ''
 
@@ -2081,8 +2103,8 @@ def extract_pages(wiki_dump_path, limit=None):
 	"""
 	out = StringIO()
 	pages=[]
-	with open(wiki_dump_path, 'r') as wiki_dump:
-		for page_data in pages_from(wiki_dump):
+	with open(wiki_dump_path, 'rb') as wiki_dump:
+		for page_data in pages_from_bytes(wiki_dump):
 			id, revid, title, ns, catSet, page = page_data
 			if ns in ['0','118']: # articles and reconstructions
 				e = Extractor(id, revid, title, page) 
@@ -2098,8 +2120,8 @@ def get_titles_from_wiki_dump(wiki_dump_path, limit=None):
 	Get the list of titles that are in a wikidump
 	"""
 	pages=[]
-	with open(wiki_dump_path, 'r') as wiki_dump:
-		for page_data in pages_from(wiki_dump):
+	with open(wiki_dump_path, 'rb') as wiki_dump:
+		for page_data in pages_from_bytes(wiki_dump):
 			id, revid, title, ns, catSet, page = page_data
 			if ns in ['0','118']: # articles and reconstructions
 				pages.append(title)
@@ -2115,20 +2137,11 @@ def get_page_from_wiki_dump(word, wiki_dump_path):
 	finds a page by title from a wiktionary dump
 	Returns the lines between <page> and </page> (inclusive)
 	Returns a list of lines
+	Seeks to the page through the dump index (see get_dump_index)
 	"""
-	current_page = []
-	found_title = False
-	with open(wiki_dump_path, 'r') as wiki_dump:
-		for i,line in enumerate(wiki_dump):
-			stripped_line = line.strip()
-			if stripped_line == '<page>':
-				current_page = []
-			elif found_title and stripped_line == '</page>': 
-				current_page.append(line)
-				return current_page
-			elif stripped_line == f'<title>{word}</title>':
-				found_title = True
-			current_page.append(line)
+	page = get_dump_index(wiki_dump_path).read_page(word)
+	if page:
+		return page.decode('utf-8').splitlines(keepends=True)
 
 # input_path = '/gdrive/My Drive/Work/EtymologyExplorer/Development/input/enwiktionary-latest-pages-articles.xml'
 def get_data_from_title(title, input_path):